@@ -0,0 +1,265 @@
+"""Benchmarks for the DBService query and write paths.
+
+Run from the repository root with the sources on the path, e.g.:
+
+    PYTHONPATH=src uv run python -m benchmarks.db_bench --messages 10000 1000000
+    PYTHONPATH=src uv run python -m benchmarks.db_bench --messages 10000 \\
+        --baseline benchmarks/results/baseline.json
+
+Every run works on a copy of the cached synthetic database, so write benchmarks
+don't change the dataset between runs."""
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict
+from datetime import UTC, datetime
+from pathlib import Path
+
+from loguru import logger
+
+from db.models import User
+from db.service import DBService, HistoryGranularity
+
+from .synthetic import DatasetSpec, get_database
+
+DEFAULT_DATA_DIR = Path(__file__).parent / "data"
+DEFAULT_RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    index = min(round(pct / 100 * (len(sorted_values) - 1)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(
+    operation: Callable[[int], object], iterations: int, warmup: int
+) -> dict[str, float]:
+    """Calls operation(i) 'iterations' times and returns throughput and latency percentiles"""
+    for i in range(warmup):
+        operation(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_s": iterations / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def build_operations(db: DBService, seed: int) -> dict[str, Callable[[int], object]]:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db.db_url)
+    try:
+        message_ids = [
+            row[0]
+            for row in conn.execute(
+                "SELECT ogmessage_id FROM messages ORDER BY random() LIMIT 10000"
+            )
+        ]
+        posters = conn.execute(
+            "SELECT author_id, COUNT(*) FROM messages WHERE roundness NOT NULL GROUP BY author_id"
+        ).fetchall()
+    finally:
+        conn.close()
+    authors = [author_id for author_id, _ in posters]
+    # Cumulative once, so each draw is a bisect instead of O(users) in the timed region
+    cum_weights = list(itertools.accumulate(count for _, count in posters))
+
+    def pick_author() -> int:
+        # Lookups follow the same skew as the posts, hot users are asked more often
+        return rng.choices(authors, cum_weights=cum_weights)[0]
+
+    def upsert_message_stats(i: int) -> None:
+        db.upsert_message_stats(
+            ogmessage_id=rng.choice(message_ids),
+            roundness=rng.random(),
+            labels_json={"bread": rng.random()},
+        )
+
+    def upsert_user_info(i: int) -> None:
+        db.upsert_user_info(
+            User(author_id=pick_author(), author_nickname=None, author_name=f"b{i}")
+        )
+
+    return {
+        "upsert_message_stats": upsert_message_stats,
+        "upsert_user_info": upsert_user_info,
+        "get_roundness_history": lambda i: db.get_roundness_history(pick_author()),
+        "get_roundness_history_weekly": lambda i: db.get_roundness_history_buckets(
+            pick_author(), HistoryGranularity.WEEK
+        ),
+        "get_roundness_history_monthly": lambda i: db.get_roundness_history_buckets(
+            pick_author(), HistoryGranularity.MONTH
+        ),
+        "get_max_roundness_leaderboard": lambda i: db.get_max_roundness_leaderboard(10),
+        "get_min_roundness_leaderboard": lambda i: db.get_min_roundness_leaderboard(10),
+        "get_max_roundness_for_user": lambda i: db.get_max_roundness_for_user(
+            pick_author()
+        ),
+        "get_min_roundness_for_user": lambda i: db.get_min_roundness_for_user(
+            pick_author()
+        ),
+        "select_user_info": lambda i: db.select_user_info(pick_author()),
+    }
+
+
+def run_dataset(spec: DatasetSpec, args: argparse.Namespace) -> dict[str, dict]:
+    source = get_database(spec, args.data_dir)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        work_path = Path(workdir) / source.name
+        shutil.copyfile(source, work_path)
+        db = DBService(str(work_path))
+        operations = build_operations(db, args.seed)
+        for name, operation in operations.items():
+            if args.only and name not in args.only:
+                continue
+            result = measure(operation, args.iterations, args.warmup)
+            results[name] = result
+            print(
+                f"{spec.messages:>10} {name:<32} {result['ops_per_s']:>10.1f} ops/s"
+                f"  p50 {result['p50_ms']:8.3f}ms  p99 {result['p99_ms']:8.3f}ms"
+            )
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Prints the change of every benchmark against the baseline, returns False on regressions"""
+    ok = True
+    print("\nComparison against baseline (p50 latency / throughput):")
+    for dataset, results in current["datasets"].items():
+        base_results = baseline["datasets"].get(dataset)
+        if base_results is None:
+            print(f"{dataset}: not in baseline")
+            continue
+        for name, result in results.items():
+            base = base_results.get(name)
+            if base is None:
+                continue
+            p50_change = (result["p50_ms"] - base["p50_ms"]) / base["p50_ms"] * 100
+            ops_change = (
+                (result["ops_per_s"] - base["ops_per_s"]) / base["ops_per_s"] * 100
+            )
+            regression = p50_change > threshold
+            ok = ok and not regression
+            print(
+                f"{dataset} {name:<32} p50 {p50_change:+7.1f}%  ops/s {ops_change:+7.1f}%"
+                + ("  REGRESSION" if regression else "")
+            )
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--messages",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000],
+        help="Dataset sizes to benchmark (number of messages)",
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--skew",
+        type=float,
+        default=1.1,
+        help="Zipf exponent of posts per user (0 = every user posts the same)",
+    )
+    parser.add_argument("--days", type=int, default=3 * 365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--only", nargs="*", help="Only run the benchmarks with these names"
+    )
+    parser.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR)
+    parser.add_argument(
+        "--output", type=Path, help="Where to save the JSON results (default: results/)"
+    )
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="p50 slowdown (in %%) reported as a regression",
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    # The service logs every call, which would dominate the measurements
+    logger.disable("db")
+    started_at = datetime.now(UTC)
+    report = {
+        "meta": {
+            "started_at": started_at.isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+        },
+        "datasets": {},
+        "specs": {},
+    }
+    for messages in args.messages:
+        spec = DatasetSpec(
+            messages=messages,
+            users=args.users,
+            skew=args.skew,
+            days=args.days,
+            seed=args.seed,
+        )
+        report["specs"][spec.name] = asdict(spec)
+        report["datasets"][spec.name] = run_dataset(spec, args)
+
+    output = args.output or (
+        DEFAULT_RESULTS_DIR / f"db_bench_{started_at:%Y%m%dT%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults saved to {output}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if not compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
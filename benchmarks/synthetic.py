@@ -0,0 +1,127 @@
+"""Synthetic database generation for the DB benchmarks.
+
+Databases are generated with the real schema (DBService.create_db) and cached on disk
+by their parameters, so big datasets are only built once."""
+
+import json
+import random
+import sqlite3
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from loguru import logger
+
+from db.models import ms_to_snowflake
+from db.service import DBService
+
+LABELS = ["bread", "sourdough", "baguette", "brioche", "focaccia", "burnt", "round"]
+BATCH_SIZE = 50_000
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    messages: int
+    users: int = 1000
+    # Zipf exponent for the posts per user distribution (0 = uniform)
+    skew: float = 1.1
+    # Time range covered by the posts, ending at 'end_ms'
+    days: int = 3 * 365
+    end_ms: int = 1760000000000
+    seed: int = 42
+
+    @property
+    def name(self) -> str:
+        return (
+            f"msgs{self.messages}_users{self.users}_skew{self.skew}"
+            f"_days{self.days}_seed{self.seed}"
+        )
+
+
+def user_ids(spec: DatasetSpec) -> list[int]:
+    rng = random.Random(spec.seed)
+    return [
+        ms_to_snowflake(spec.end_ms - rng.randrange(10**10), i)
+        for i in range(spec.users)
+    ]
+
+
+def user_weights(spec: DatasetSpec) -> list[float]:
+    return [1 / (rank**spec.skew) for rank in range(1, spec.users + 1)]
+
+
+def _message_rows(spec: DatasetSpec, authors: list[int]):
+    rng = random.Random(spec.seed + 1)
+    weights = user_weights(spec)
+    start_ms = spec.end_ms - spec.days * 24 * 3600 * 1000
+    # Evenly spread posts over the time range (sorted ids, like real messages)
+    step_ms = max((spec.end_ms - start_ms) / spec.messages, 1)
+    channel_ids = [ms_to_snowflake(start_ms, 1000 + i) for i in range(3)]
+    guild_id = ms_to_snowflake(start_ms, 2000)
+    for offset in range(0, spec.messages, BATCH_SIZE):
+        count = min(BATCH_SIZE, spec.messages - offset)
+        batch_authors = rng.choices(authors, weights=weights, k=count)
+        rows = []
+        for i, author_id in enumerate(batch_authors):
+            index = offset + i
+            timestamp = int(start_ms + index * step_ms)
+            ogmessage_id = ms_to_snowflake(timestamp, index)
+            replymessage_id = ms_to_snowflake(timestamp + 1500, index)
+            channel_id = rng.choice(channel_ids)
+            if rng.random() < 0.05:
+                roundness = None
+                labels = {}
+            else:
+                roundness = rng.betavariate(5, 2)
+                labels = {"bread": round(rng.uniform(0.5, 1.0), 3)}
+                for label in rng.sample(LABELS[1:], rng.randint(0, 3)):
+                    labels[label] = round(rng.random(), 3)
+            rows.append(
+                (
+                    ogmessage_id,
+                    f"https://discord.com/channels/{guild_id}/{channel_id}/{replymessage_id}",
+                    replymessage_id,
+                    author_id,
+                    channel_id,
+                    guild_id,
+                    roundness,
+                    json.dumps(labels),
+                )
+            )
+        yield rows
+
+
+def build_database(spec: DatasetSpec, path: Path) -> None:
+    logger.info(f"Generating synthetic database {spec.name} in {path}")
+    started = time.perf_counter()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    DBService(str(path)).create_db()
+    authors = user_ids(spec)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA journal_mode=MEMORY")
+        conn.executemany(
+            "INSERT INTO discordusers (author_id, author_nickname, author_name) VALUES (?, ?, ?)",
+            [(a, None, f"baker{i}") for i, a in enumerate(authors)],
+        )
+        for rows in _message_rows(spec, authors):
+            conn.executemany(
+                "INSERT INTO messages (ogmessage_id, replymessage_jump_url, replymessage_id, author_id, channel_id, guild_id, roundness, labels_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        conn.commit()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    path.with_suffix(".json").write_text(json.dumps(asdict(spec), indent=2))
+    logger.info(f"Generated {spec.name} in {time.perf_counter() - started:.1f}s")
+
+
+def get_database(spec: DatasetSpec, data_dir: Path) -> Path:
+    """Returns the path of the cached database for 'spec', building it if needed"""
+    path = data_dir / f"{spec.name}.db"
+    if not path.exists() or not path.with_suffix(".json").exists():
+        build_database(spec, path)
+    return path
@@ -1,7 +1,26 @@
 import json
+from datetime import UTC, date, datetime
 
 from pydantic import BaseModel
 
+DISCORD_EPOCH_MS = 1420070400000
+
+
+def snowflake_to_datetime(snowflake: int) -> datetime:
+    """Discord ids embed the creation time in their upper bits"""
+    return datetime.fromtimestamp(((snowflake >> 22) + DISCORD_EPOCH_MS) / 1000, UTC)
+
+
+def ms_to_snowflake(timestamp_ms: int, sequence: int = 0) -> int:
+    """Id created at 'timestamp_ms' (Unix ms). 'sequence' goes in the low bits, where
+    Discord puts the worker and increment that tell apart ids of the same ms"""
+    return (max(timestamp_ms - DISCORD_EPOCH_MS, 0) << 22) | (sequence & 0x3FFFFF)
+
+
+def datetime_to_snowflake(dt: datetime) -> int:
+    """Smallest id that could have been created at 'dt', used for range filters"""
+    return ms_to_snowflake(int(dt.timestamp() * 1000))
+
 
 class Message(BaseModel):
     ogmessage_id: int
@@ -33,3 +52,19 @@ class User(BaseModel):
     @classmethod
     def select(cls) -> str:
         return "SELECT author_id, author_nickname, author_name FROM discordusers"
+
+
+class RoundnessPoint(BaseModel):
+    ogmessage_id: int
+    posted_at: datetime
+    roundness: float
+
+
+class RoundnessBucket(BaseModel):
+    bucket_start: date
+    count: int
+    mean: float
+    min: float
+    max: float
+    # Post-weighted mean over this bucket and the previous ones in the rolling window
+    rolling_mean: float
@@ -0,0 +1,289 @@
+import time
+from enum import StrEnum
+
+from loguru import logger
+from pydantic import BaseModel
+
+from monitoring.metrics import METRICS
+from monitoring.tracing import TRACER
+
+from .service import DBService, db_write
+
+
+class JobStatus(StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    id: int
+    # Message whose attachments are analysed and that gets the reply
+    ogmessage_id: int
+    channel_id: int
+    guild_id: int
+    min_confidence: float
+    # Also tells the claims of a job apart: each claim increments it
+    attempts: int
+    worker: str | None
+    # Trace of the message that enqueued the job, continued by the worker
+    trace_id: str | None
+    created_at: float
+
+    @classmethod
+    def columns(cls) -> str:
+        return (
+            "id, ogmessage_id, channel_id, guild_id, min_confidence, attempts, worker,"
+            " trace_id, created_at"
+        )
+
+    @classmethod
+    def from_row(cls, row: list) -> "Job":
+        field_names = list(cls.model_fields.keys())
+        return cls(**dict(zip(field_names, row)))
+
+
+class JobQueue:
+    """Durable work queue for bread predictions, stored in the bot database.
+    Workers claim jobs with a lease, which they renew while they work on the job: a job
+    whose worker died (crash, restart) becomes claimable again once its lease expires.
+    Completing, failing and renewing only apply to the claim the worker holds, so a
+    worker whose job was claimed again can't change it anymore"""
+
+    def __init__(
+        self,
+        db: DBService,
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 30,
+    ):
+        self.db = db
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+
+    @db_write
+    def create_table(self) -> None:
+        create_table_sql = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ogmessage_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            min_confidence REAL NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_until REAL,
+            worker TEXT,
+            last_error TEXT,
+            trace_id TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+        # A message can only have one unfinished job at a time
+        create_unique_sql = """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_unfinished_message
+        ON jobs (ogmessage_id) WHERE status IN ('pending', 'running')
+        """
+        create_claim_index_sql = """
+        CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, available_at)
+        """
+        with self.db.connect() as cursor:
+            cursor.execute(create_table_sql)
+            cursor.execute(create_unique_sql)
+            cursor.execute(create_claim_index_sql)
+            # Tables created before the jobs carried their trace
+            cursor.execute("PRAGMA table_info(jobs)")
+            if "trace_id" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE jobs ADD COLUMN trace_id TEXT")
+
+    @db_write
+    def enqueue(
+        self,
+        ogmessage_id: int,
+        channel_id: int,
+        guild_id: int,
+        min_confidence: float,
+        trace_id: str | None = None,
+    ) -> bool:
+        """Adds a job for the message. Returns False if it already has an unfinished job"""
+        now = time.time()
+        insert_sql = """
+        INSERT INTO jobs (ogmessage_id, channel_id, guild_id, min_confidence, status, available_at, trace_id, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        """
+        inserted = False
+        with (
+            TRACER.span("db.enqueue_job", METRICS.db_write_seconds),
+            self.db.connect() as cursor,
+        ):
+            cursor.execute(
+                insert_sql,
+                (
+                    ogmessage_id,
+                    channel_id,
+                    guild_id,
+                    min_confidence,
+                    JobStatus.PENDING.value,
+                    now,
+                    trace_id,
+                    now,
+                    now,
+                ),
+            )
+            inserted = cursor.rowcount == 1
+        logger.info(
+            f"Enqueued job for message {ogmessage_id}"
+            if inserted
+            else f"Message {ogmessage_id} already has a pending job"
+        )
+        return inserted
+
+    @db_write
+    def claim(
+        self,
+        worker: str,
+        shard_count: int | None = None,
+        shard_ids: list[int] | None = None,
+    ) -> Job | None:
+        """Leases the oldest available job to 'worker'. With 'shard_ids', only jobs of
+        the guilds on those gateway shards are claimed: the process connected to these
+        shards is the one that can fetch the messages and reply"""
+        now = time.time()
+        shard_filter = ""
+        params: list = [now + self.lease_seconds, worker, now, now, now]
+        if shard_ids is not None:
+            # Same guild to shard mapping as Discord
+            shard_filter = (
+                f"AND (guild_id >> 22) % ? IN ({', '.join('?' * len(shard_ids))})"
+            )
+            params += [shard_count, *shard_ids]
+        claim_sql = f"""
+        UPDATE jobs SET
+            status = '{JobStatus.RUNNING.value}',
+            attempts = attempts + 1,
+            lease_until = ?,
+            worker = ?,
+            updated_at = ?
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE (
+                (status = '{JobStatus.PENDING.value}' AND available_at <= ?)
+                OR (status = '{JobStatus.RUNNING.value}' AND lease_until < ?)
+            )
+            {shard_filter}
+            ORDER BY id
+            LIMIT 1
+        )
+        RETURNING {Job.columns()}
+        """
+        row = None
+        with self.db.connect() as cursor:
+            cursor.execute(claim_sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        job = Job.from_row(row)
+        logger.debug(f"Worker {worker} claimed job {job.id} (attempt {job.attempts})")
+        return job
+
+    # Matches the job only while it's still held by the claim in 'job'
+    _HELD_BY_CLAIM_SQL = f"id = ? AND worker = ? AND attempts = ? AND status = '{JobStatus.RUNNING.value}'"
+
+    @db_write
+    def renew_lease(self, job: Job) -> bool:
+        """Extends the lease of a running job. False if the worker lost the job"""
+        now = time.time()
+        update_sql = f"""
+        UPDATE jobs SET lease_until = ?, updated_at = ? WHERE {self._HELD_BY_CLAIM_SQL}
+        """
+        renewed = False
+        with self.db.connect() as cursor:
+            cursor.execute(
+                update_sql,
+                (now + self.lease_seconds, now, job.id, job.worker, job.attempts),
+            )
+            renewed = cursor.rowcount == 1
+        return renewed
+
+    @db_write
+    def complete(self, job: Job) -> bool:
+        """Marks the job done. False if the worker lost the job"""
+        update_sql = f"""
+        UPDATE jobs SET status = ?, lease_until = NULL, updated_at = ?
+        WHERE {self._HELD_BY_CLAIM_SQL}
+        """
+        completed = False
+        with self.db.connect() as cursor:
+            cursor.execute(
+                update_sql,
+                (JobStatus.DONE.value, time.time(), job.id, job.worker, job.attempts),
+            )
+            completed = cursor.rowcount == 1
+        if not completed:
+            logger.warning(f"Job {job.id} was claimed again, not completing it")
+        return completed
+
+    @db_write
+    def fail(self, job: Job, error: str) -> bool:
+        """Puts the job back in the queue with a delay, or marks it failed when it's out
+        of attempts. False if the worker lost the job"""
+        now = time.time()
+        if job.attempts >= self.max_attempts:
+            status = JobStatus.FAILED
+            logger.error(f"Job {job.id} failed after {job.attempts} attempts: {error}")
+        else:
+            status = JobStatus.PENDING
+            logger.warning(f"Job {job.id} failed, will retry: {error}")
+        update_sql = f"""
+        UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, last_error = ?, updated_at = ?
+        WHERE {self._HELD_BY_CLAIM_SQL}
+        """
+        failed = False
+        with self.db.connect() as cursor:
+            cursor.execute(
+                update_sql,
+                (
+                    status.value,
+                    now + self.retry_delay_seconds * job.attempts,
+                    error,
+                    now,
+                    job.id,
+                    job.worker,
+                    job.attempts,
+                ),
+            )
+            failed = cursor.rowcount == 1
+        if not failed:
+            logger.warning(f"Job {job.id} was claimed again, not failing it")
+        return failed
+
+    @db_write
+    def release_running(self) -> int:
+        """Makes the jobs left running by a previous run claimable right away (instead of
+        waiting for their lease to expire). Only safe when no other process uses the queue:
+        in the sharded deployment the writer does it before the bot processes start"""
+        update_sql = f"""
+        UPDATE jobs SET status = '{JobStatus.PENDING.value}', lease_until = NULL, updated_at = ?
+        WHERE status = '{JobStatus.RUNNING.value}'
+        """
+        released = 0
+        with self.db.connect() as cursor:
+            cursor.execute(update_sql, (time.time(),))
+            released = cursor.rowcount
+        return released
+
+    def count_unfinished(self) -> int:
+        count_sql = f"""
+        SELECT COUNT(*) FROM jobs
+        WHERE status IN ('{JobStatus.PENDING.value}', '{JobStatus.RUNNING.value}')
+        """
+        count = 0
+        with self.db.connect() as cursor:
+            cursor.execute(count_sql)
+            (count,) = cursor.fetchone()
+        return count
@@ -2,11 +2,24 @@ import json
 import os
 import sqlite3
 from contextlib import contextmanager
+from datetime import date, datetime
 from enum import StrEnum
+from pathlib import Path
 
 from loguru import logger
 
-from .models import Message, User
+from monitoring.metrics import METRICS
+from monitoring.tracing import TRACER
+
+from .models import (
+    DISCORD_EPOCH_MS,
+    Message,
+    RoundnessBucket,
+    RoundnessPoint,
+    User,
+    datetime_to_snowflake,
+    snowflake_to_datetime,
+)
 
 
 class OrderBy(StrEnum):
@@ -14,19 +27,55 @@ class OrderBy(StrEnum):
     DES = "DESC"
 
 
+class HistoryGranularity(StrEnum):
+    POST = "post"
+    WEEK = "week"
+    MONTH = "month"
+
+
+# SQL expressions giving the first day of the bucket a message belongs to.
+# The post time comes from the snowflake id (messages don't store a timestamp)
+_POSTED_AT_SQL = f"((ogmessage_id >> 22) + {DISCORD_EPOCH_MS}) / 1000, 'unixepoch'"
+_BUCKET_START_SQL = {
+    HistoryGranularity.WEEK: f"date({_POSTED_AT_SQL}, 'weekday 0', '-6 days')",
+    HistoryGranularity.MONTH: f"date({_POSTED_AT_SQL}, 'start of month')",
+}
+
+
 class UserNotFound(Exception): ...
 
 
+def db_write(func):
+    """Marks a method that writes to the database. In the sharded deployment these are
+    forwarded to the writer process (see sharding.client), everything else runs on the
+    local read-only connections"""
+    func.__db_write__ = True
+    return func
+
+
+def is_db_write(method) -> bool:
+    return getattr(method, "__db_write__", False)
+
+
 class DBService:
-    def __init__(self, db_url: str):
+    def __init__(self, db_url: str, read_only: bool = False):
         self.db_url = db_url
+        self.read_only = read_only
+
+    def _open(self) -> sqlite3.Connection:
+        if self.read_only:
+            # Readers of a WAL database never block the writer, nor are blocked by it
+            return sqlite3.connect(
+                f"{Path(self.db_url).resolve().as_uri()}?mode=ro", uri=True
+            )
+        return sqlite3.connect(self.db_url)
 
     @contextmanager
     def connect(self):
         conn = None
         cursor = None
         try:
-            conn = sqlite3.connect(self.db_url)
+            conn = self._open()
             cursor = conn.cursor()
             yield cursor
             conn.commit()
@@ -40,6 +89,7 @@ class DBService:
             if conn:
                 conn.close()
 
+    @db_write
     def create_db(self) -> None:
         # Define the SQL command to create the "messages" table
         create_table_sql = """
@@ -62,12 +112,36 @@ class DBService:
             author_name TEXT
         ) ;  
         """
+        # Covers the per-user history queries so they never touch the table itself
+        create_history_index_sql = """
+        CREATE INDEX IF NOT EXISTS idx_messages_author_history
+        ON messages (author_id, ogmessage_id, roundness)
+        """
+        # Used to find the last analysed message of a channel
+        create_channel_index_sql = """
+        CREATE INDEX IF NOT EXISTS idx_messages_channel
+        ON messages (channel_id, ogmessage_id)
+        """
+        # Where the catch-up backfill of each channel stopped
+        create_backfill_table_sql = """
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            channel_id INTEGER PRIMARY KEY,
+            last_message_id INTEGER
+        )
+        """
         os.makedirs(os.path.dirname(self.db_url), exist_ok=True)
         with self.connect() as cursor:
+            # WAL lets the read-only connections of other processes read while
+            # the writer writes. The mode is persistent in the database file
+            cursor.execute("PRAGMA journal_mode=WAL")
             # Execute the SQL command
             cursor.execute(create_table_sql)
             cursor.execute(create_usertable_sql)
+            cursor.execute(create_history_index_sql)
+            cursor.execute(create_channel_index_sql)
+            cursor.execute(create_backfill_table_sql)
 
+    @db_write
     def upsert_message_stats(
         self, ogmessage_id: int, roundness: float, labels_json: dict
     ) -> None:
@@ -84,9 +158,13 @@ class DBService:
             labels_json=excluded.labels_json
         """
 
-        with self.connect() as cursor:
+        with (
+            TRACER.span("db.upsert_message_stats", METRICS.db_write_seconds),
+            self.connect() as cursor,
+        ):
             cursor.execute(upsert_sql, (ogmessage_id, roundness, labels_json_str))
 
+    @db_write
     def upsert_user_info(self, user: User) -> None:
         # Inserts the author info to cache results so we don't have to get info from discord all the time
         logger.info(
@@ -102,7 +180,10 @@ class DBService:
             author_name=excluded.author_name
         """
 
-        with self.connect() as cursor:
+        with (
+            TRACER.span("db.upsert_user_info", METRICS.db_write_seconds),
+            self.connect() as cursor,
+        ):
             cursor.execute(
                 upsert_sql, (user.author_id, user.author_nickname, user.author_name)
             )
@@ -121,6 +202,31 @@ class DBService:
                 )
             raise UserNotFound()
 
+    def select_recent_posters(self, n: int) -> list[User]:
+        """User info of the 'n' authors who posted most recently"""
+        logger.info(f"Fetching the {n} most recent posters")
+        select_sql = """
+        SELECT u.author_id, u.author_nickname, u.author_name
+        FROM (
+            SELECT author_id, MAX(ogmessage_id) AS last_post FROM messages
+            WHERE author_id IS NOT NULL
+            GROUP BY author_id
+            ORDER BY last_post DESC
+            LIMIT ?
+        ) AS recent
+        JOIN discordusers AS u ON u.author_id = recent.author_id
+        ORDER BY recent.last_post DESC
+        """
+        rows = []
+        with self.connect() as cursor:
+            cursor.execute(select_sql, (n,))
+            rows = cursor.fetchall()
+        return [
+            User(author_id=row[0], author_nickname=row[1], author_name=row[2])
+            for row in rows
+        ]
+
+    @db_write
     def upsert_message_discordinfo(
         self,
         ogmessage_id: int,
@@ -144,7 +250,10 @@ class DBService:
             guild_id=excluded.guild_id
         """
 
-        with self.connect() as cursor:
+        with (
+            TRACER.span("db.upsert_message_discordinfo", METRICS.db_write_seconds),
+            self.connect() as cursor,
+        ):
             cursor.execute(
                 upsert_sql,
                 (
@@ -157,6 +266,105 @@ class DBService:
                 ),
             )
 
+    @db_write
+    def upsert_messages(self, messages: list[Message]) -> None:
+        """Upserts complete message rows (stats and discord info) in a single transaction"""
+        logger.info(
+            f"Upserting: {[m.ogmessage_id for m in messages]} in messages (batch)"
+        )
+        upsert_sql = """
+        INSERT INTO messages (ogmessage_id, replymessage_jump_url, replymessage_id, author_id, channel_id, guild_id, roundness, labels_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ogmessage_id) DO UPDATE SET
+            replymessage_jump_url=excluded.replymessage_jump_url,
+            replymessage_id=excluded.replymessage_id,
+            author_id=excluded.author_id,
+            channel_id=excluded.channel_id,
+            guild_id=excluded.guild_id,
+            roundness=excluded.roundness,
+            labels_json=excluded.labels_json
+        """
+        with (
+            TRACER.span("db.upsert_messages", METRICS.db_write_seconds),
+            self.connect() as cursor,
+        ):
+            cursor.executemany(
+                upsert_sql,
+                [
+                    (
+                        m.ogmessage_id,
+                        m.replymessage_jump_url,
+                        m.replymessage_id,
+                        m.author_id,
+                        m.channel_id,
+                        m.guild_id,
+                        m.roundness,
+                        json.dumps(m.labels_json),
+                    )
+                    for m in messages
+                ],
+            )
+
+    def select_message_columns_after(
+        self, ogmessage_id: int
+    ) -> list[tuple[int, int | None, float | None, str | None]]:
+        """Raw (ogmessage_id, author_id, roundness, labels_json) rows after the given id,
+        for the columnar snapshot used by the server stats"""
+        logger.info(f"Fetching message columns after {ogmessage_id}")
+        query = """
+        SELECT ogmessage_id, author_id, roundness, labels_json FROM messages
+        WHERE ogmessage_id > ?
+        ORDER BY ogmessage_id
+        """
+        rows = []
+        with self.connect() as cursor:
+            cursor.execute(query, (ogmessage_id,))
+            rows = cursor.fetchall()
+        return rows
+
+    def select_analysed_message_ids(self, ogmessage_ids: list[int]) -> set[int]:
+        """The ids among 'ogmessage_ids' that already have a row"""
+        query = f"""
+        SELECT ogmessage_id FROM messages
+        WHERE ogmessage_id IN ({", ".join("?" * len(ogmessage_ids))})
+        """
+        rows = []
+        with self.connect() as cursor:
+            cursor.execute(query, ogmessage_ids)
+            rows = cursor.fetchall()
+        return {row[0] for row in rows}
+
+    def get_backfill_start(self, channel_id: int) -> int | None:
+        """Returns the message id the backfill of a channel should continue after: the
+        newest analysed message or the saved checkpoint, whichever is newer"""
+        query = """
+        SELECT MAX(last_id) FROM (
+            SELECT MAX(ogmessage_id) AS last_id FROM messages WHERE channel_id = ?
+            UNION ALL
+            SELECT last_message_id FROM backfill_checkpoints WHERE channel_id = ?
+        )
+        """
+        row = None
+        with self.connect() as cursor:
+            cursor.execute(query, (channel_id, channel_id))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @db_write
+    def set_backfill_checkpoint(self, channel_id: int, last_message_id: int) -> None:
+        logger.debug(f"Backfill checkpoint for {channel_id}: {last_message_id}")
+        upsert_sql = """
+        INSERT INTO backfill_checkpoints (channel_id, last_message_id)
+        VALUES (?, ?)
+        ON CONFLICT(channel_id) DO UPDATE SET
+            last_message_id=excluded.last_message_id
+        """
+        with (
+            TRACER.span("db.set_backfill_checkpoint", METRICS.db_write_seconds),
+            self.connect() as cursor,
+        ):
+            cursor.execute(upsert_sql, (channel_id, last_message_id))
+
     def get_min_roundness_for_user(self, user_id: int) -> Message:
         return self._get_roundness_message_byuserid(user_id, OrderBy.ASC)
 
@@ -207,22 +415,118 @@ class DBService:
                 result.append(Message.from_row(row))
         return result
 
-    def get_roundness_history(self, user_id: int) -> list[tuple[int, int]]:
-        # Returns the roundness history for the user
-        logger.info(f"Fetching  roundness of user {user_id}")
+    def prime_indexes(self) -> int:
+        """Reads the history index end to end, which brings its pages in the OS page
+        cache without reading the rows themselves. Returns the number of entries"""
+        count_sql = """
+        SELECT COUNT(roundness) FROM messages INDEXED BY idx_messages_author_history
+        WHERE author_id IS NOT NULL
+        """
+        count = 0
+        with self.connect() as cursor:
+            cursor.execute(count_sql)
+            count = cursor.fetchone()[0]
+        return count
+
+    @staticmethod
+    def _history_range(
+        since: datetime | None, until: datetime | None
+    ) -> tuple[int, int]:
+        lower = datetime_to_snowflake(since) if since else 0
+        upper = datetime_to_snowflake(until) if until else (1 << 63) - 1
+        return lower, upper
+
+    def get_roundness_history(
+        self,
+        user_id: int,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> list[RoundnessPoint]:
+        """Returns a page of the roundness history for the user, newest posts first"""
+        logger.info(f"Fetching roundness of user {user_id}")
+        lower, upper = self._history_range(since, until)
         roundness_query = f"""
-        {Message.select()}
+        SELECT ogmessage_id, roundness FROM messages
         WHERE 1=1
         AND roundness not null
         AND author_id = ?
+        AND ogmessage_id >= ? AND ogmessage_id < ?
         ORDER BY ogmessage_id {OrderBy.DES.value}
-        LIMIT 50
+        LIMIT ? OFFSET ?
         """
-        result = []
+        rows = []
         with self.connect() as cursor:
-            cursor.execute(roundness_query, (user_id,))
+            cursor.execute(roundness_query, (user_id, lower, upper, limit, offset))
             rows = cursor.fetchall()
-            for i, row in enumerate(rows, start=1):
-                message = Message.from_row(row)
-                result.append((i, message.roundness))
-        return result
+        return [
+            RoundnessPoint(
+                ogmessage_id=ogmessage_id,
+                posted_at=snowflake_to_datetime(ogmessage_id),
+                roundness=roundness,
+            )
+            for ogmessage_id, roundness in rows
+        ]
+
+    def get_roundness_history_buckets(
+        self,
+        user_id: int,
+        granularity: HistoryGranularity,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        rolling_window: int = 4,
+        limit: int = 120,
+        offset: int = 0,
+    ) -> list[RoundnessBucket]:
+        """Returns per week/month roundness aggregates for the user, newest bucket first.
+        Everything is aggregated in SQLite, the rolling mean covers 'rolling_window'
+        buckets (the current one included) and is computed before paging"""
+        if granularity not in _BUCKET_START_SQL:
+            raise ValueError(f"Can't bucket history by {granularity}")
+        logger.info(f"Fetching {granularity} roundness buckets of user {user_id}")
+        lower, upper = self._history_range(since, until)
+        buckets_query = f"""
+        WITH buckets AS (
+            SELECT
+                {_BUCKET_START_SQL[granularity]} AS bucket_start,
+                COUNT(*) AS n,
+                SUM(roundness) AS total,
+                MIN(roundness) AS min_roundness,
+                MAX(roundness) AS max_roundness
+            FROM messages
+            WHERE roundness not null
+            AND author_id = ?
+            AND ogmessage_id >= ? AND ogmessage_id < ?
+            GROUP BY bucket_start
+        )
+        SELECT
+            bucket_start,
+            n,
+            total / n,
+            min_roundness,
+            max_roundness,
+            SUM(total) OVER rolling / SUM(n) OVER rolling
+        FROM buckets
+        WINDOW rolling AS (
+            ORDER BY bucket_start ROWS BETWEEN ? PRECEDING AND CURRENT ROW
+        )
+        ORDER BY bucket_start {OrderBy.DES.value}
+        LIMIT ? OFFSET ?
+        """
+        params = (user_id, lower, upper, max(rolling_window - 1, 0), limit, offset)
+        rows = []
+        with self.connect() as cursor:
+            cursor.execute(buckets_query, params)
+            rows = cursor.fetchall()
+        return [
+            RoundnessBucket(
+                bucket_start=date.fromisoformat(row[0]),
+                count=row[1],
+                mean=row[2],
+                min=row[3],
+                max=row[4],
+                rolling_mean=row[5],
+            )
+            for row in rows
+        ]
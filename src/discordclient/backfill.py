@@ -0,0 +1,155 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING
+
+import discord
+from loguru import logger
+
+from db.service import DBService
+from monitoring.metrics import METRICS
+from settings import SETTINGS
+
+from .plain_message import FreeMessageHandler
+
+if TYPE_CHECKING:
+    from .service import DiscordBot
+
+
+class BackfillAlreadyRunning(Exception): ...
+
+
+class Backfill:
+    """Catch-up for the bread posts made while the bot was offline: pages through the
+    history of the bread channels after the last analysed message and submits the bread
+    candidates. The progress is checkpointed after every page so it can resume"""
+
+    def __init__(self, bot: "DiscordBot", db: DBService):
+        self.bot = bot
+        self.db = db
+        self._lock = asyncio.Lock()
+        # Where each channel's backfill continues from. Recorded before the bot goes
+        # live: live posts get analysed too, and would hide the offline gap
+        self.start_points: dict[int, int | None] = {}
+
+    def record_start_points(self) -> None:
+        for channel_id in SETTINGS.discord_bread_channels:
+            self.start_points[channel_id] = self.db.get_backfill_start(channel_id)
+        logger.info(f"Backfill: start points {self.start_points}")
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, channel_ids: list[int] | None = None) -> dict[int, int]:
+        """Backfills the given channels (all the bread channels by default).
+        Returns the number of candidates submitted per channel"""
+        if self.running:
+            raise BackfillAlreadyRunning()
+        async with self._lock:
+            results = {}
+            for channel_id in channel_ids or SETTINGS.discord_bread_channels:
+                try:
+                    results[channel_id] = await self.backfill_channel(channel_id)
+                except Exception as e:
+                    # Discord errors, or the sharded deployment's writer unreachable
+                    METRICS.errors.inc()
+                    logger.error(f"Backfill of channel {channel_id} failed: {e!r}")
+            return results
+
+    async def backfill_channel(self, channel_id: int) -> int:
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            logger.warning(f"Backfill: channel {channel_id} not found")
+            return 0
+        if channel_id in self.start_points:
+            start = self.start_points[channel_id]
+        else:
+            # Not a bread channel at startup, the live posts may hide part of the gap
+            start = self.db.get_backfill_start(channel_id)
+        if start is None:
+            # Nothing analysed yet in this channel, don't go back forever
+            after = datetime.now(UTC) - timedelta(days=SETTINGS.backfill_max_age_days)
+        else:
+            after = discord.Object(id=start)
+        logger.info(f"Backfill: channel {channel_id} after {after}")
+
+        # Bounds the number of candidates being submitted at once
+        semaphore = asyncio.Semaphore(SETTINGS.backfill_concurrency)
+        submitted = 0
+        page: list[discord.Message] = []
+        async for message in channel.history(
+            limit=None, after=after, oldest_first=True
+        ):
+            page.append(message)
+            if len(page) == SETTINGS.backfill_page_size:
+                page_submitted, complete = await self._process_page(
+                    channel_id, page, semaphore
+                )
+                submitted += page_submitted
+                if not complete:
+                    return submitted
+                page = []
+                # Leave room in the rate limits for the live traffic
+                await asyncio.sleep(SETTINGS.backfill_page_delay_seconds)
+        if page:
+            page_submitted, _ = await self._process_page(channel_id, page, semaphore)
+            submitted += page_submitted
+        logger.info(f"Backfill: channel {channel_id} done, {submitted} candidates")
+        return submitted
+
+    async def _process_page(
+        self,
+        channel_id: int,
+        page: list[discord.Message],
+        semaphore: asyncio.Semaphore,
+    ) -> tuple[int, bool]:
+        """Submits the candidates of the page and checkpoints the channel up to the
+        first failed message. Returns the number submitted and whether none failed"""
+        candidates = [m for m in page if self._is_candidate(m)]
+        if candidates:
+            # Posts made since the bot went live were analysed already
+            analysed = self.db.select_analysed_message_ids([m.id for m in candidates])
+            candidates = [m for m in candidates if m.id not in analysed]
+        failed: set[int] = set()
+
+        async def submit(message: discord.Message) -> None:
+            async with semaphore:
+                # The stats need the names of posters that haven't posted since
+                self.bot.store_user(message.author)
+                try:
+                    await self.bot.submit_bread_work(
+                        ogmessage_id=message.id,
+                        channel_id=message.channel.id,
+                        guild_id=message.guild.id,
+                        min_confidence=SETTINGS.bread_detection_confidence,
+                        message=message,
+                    )
+                except Exception as e:
+                    METRICS.errors.inc()
+                    failed.add(message.id)
+                    logger.error(f"Backfill of message {message.id} failed: {e}")
+
+        await asyncio.gather(*[submit(m) for m in candidates])
+        # Everything before the checkpoint is either queued (durable) or processed
+        checkpoint = self.start_points.get(channel_id)
+        for message in page:
+            if message.id in failed:
+                break
+            checkpoint = message.id
+        if checkpoint is not None:
+            self.start_points[channel_id] = checkpoint
+            self.db.set_backfill_checkpoint(channel_id, checkpoint)
+        if failed:
+            logger.warning(
+                f"Backfill: channel {channel_id} stopped at {checkpoint}, "
+                f"{len(failed)} messages failed. A new backfill will retry them"
+            )
+        return len(candidates) - len(failed), not failed
+
+    def _is_candidate(self, message: discord.Message) -> bool:
+        # Authors that left the server come back as plain users without roles
+        if message.author == self.bot.user or not isinstance(
+            message.author, discord.Member
+        ):
+            return False
+        return FreeMessageHandler.is_bread_candidate(message=message)
@@ -5,6 +5,7 @@ from loguru import logger
 
 import discord
 from inference.predict import ImageData, InferenceClient, PredictResponse
+from monitoring.tracing import TRACER
 from settings import SETTINGS
 
 
@@ -72,7 +73,8 @@ class FreeMessageHandler:
         """Main "bread compute" function -> Does all the compute calls
         and returns the artifacts to be sent on the discord message"""
 
-        payload = ImageData.from_img_path(input_file)
+        with TRACER.span("encode_image"):
+            payload = ImageData.from_img_path(input_file)
         res = await inference_client.predict(payload)
         # TODO: Min confidence is kinda broken right now
         if res.labels and "bread" in res.labels.keys():
@@ -82,7 +84,8 @@ class FreeMessageHandler:
                 )
                 if res.image:
                     out_path = SETTINGS.downloads_path / "predictions" / input_file.name
-                    res.save_img(out_path)
+                    with TRACER.span("save_prediction_image"):
+                        res.save_img(out_path)
                     roundness_comment = cls.get_message_from_roundness(res.roundness)
                     final_comment = labels_comment + roundness_comment
                 else:
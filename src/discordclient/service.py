@@ -1,47 +1,131 @@
 import asyncio
 import logging
+import os
+import re
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
 
 import discord
 from discord.ext import commands
 from loguru import logger
 
-from db.service import DBService, User, UserNotFound
+from db.models import Message, snowflake_to_datetime
+from db.queue import Job, JobQueue
+from db.service import DBService, HistoryGranularity, User, UserNotFound
 from inference.predict import InferenceClient
+from monitoring.metrics import METRICS
+from monitoring.tracing import TRACER
+from monitoring.watchdog import LoopWatchdog
 from settings import SETTINGS
 from stats import plots
+from stats.snapshot import MessageSnapshot
 
+from .backfill import Backfill, BackfillAlreadyRunning
 from .plain_message import FreeMessageHandler
+from .warmup import Warmup
 
+HISTORY_RANGE_UNITS = {"d": 1, "w": 7, "m": 30, "y": 365}
+# Discord ids (and so posts) can't be older than this
+DISCORD_EPOCH = snowflake_to_datetime(0)
+HISTORY_POSTS_PER_PAGE = 50
+HISTORY_BUCKETS_PER_PAGE = 120
+HISTORY_MAX_PAGE = 10_000
+# Discord limits for a single message
+DISCORD_MAX_FILES = 10
+DISCORD_MAX_CONTENT = 2000
 
-class DiscordBot(commands.Bot):
-    def __init__(self, db: DBService, inference: InferenceClient):
+
+class DiscordBot(commands.AutoShardedBot):
+    def __init__(
+        self,
+        db: DBService,
+        inference: InferenceClient,
+        queue: JobQueue | None = None,
+        watchdog: LoopWatchdog | None = None,
+        shard_ids: list[int] | None = None,
+        shard_count: int | None = None,
+    ):
         self.db = db
         self.inference = inference
+        self.queue = queue
+        self.watchdog = watchdog
+        self._watchdog_task: asyncio.Task | None = None
+        # Messages enqueued by this process, so workers don't have to fetch them again
+        self._live_messages: dict[int, discord.Message] = {}
+        self._job_available = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+        self.backfill = Backfill(self, db)
+        self.snapshot = MessageSnapshot(
+            db,
+            full_refresh_seconds=SETTINGS.stats_snapshot_full_refresh_seconds,
+            reread_seconds=SETTINGS.stats_snapshot_reread_seconds,
+        )
+        self.warmup = Warmup(self)
+        self._startup: asyncio.Task | None = None
+        # User info by author id, filled by the lookups and the warm-up
+        self._users: dict[int, User] = {}
         intents = discord.Intents.default()
         intents.message_content = True
         discord.utils.setup_logging(level=logging.INFO)
-        super().__init__(command_prefix="$", intents=intents)
+        # Without shard ids this process runs all the shards Discord recommends
+        super().__init__(
+            command_prefix="$",
+            intents=intents,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+        )
         self.register_handlers()
 
     def register_handlers(self):
         self.command(name="breadstats")(self.breadstats)
         self.command(name="hello")(self.hello)
+        commands.has_permissions(administrator=True)(
+            self.command(name="breadbackfill")(self.breadbackfill)
+        )
+
+    async def setup_hook(self):
+        # Runs on the bot loop before connecting, whatever started the bot
+        self.backfill.record_start_points()
+        if self.watchdog is not None:
+            self._watchdog_task = asyncio.create_task(self.watchdog.run())
 
     async def on_ready(self):
         logger.info(f"We have logged in as {self.user}")
+        # on_ready fires again after reconnects, the startup only runs once
+        if self._startup is None:
+            self._startup = asyncio.create_task(self.start_bread_work())
+
+    async def start_bread_work(self) -> None:
+        """Warms up, then starts the job workers and the startup backfill"""
+        if SETTINGS.warmup_enabled:
+            await self.warmup.run()
+        else:
+            self.warmup.mark_ready()
+        if self.queue is not None:
+            self.start_job_workers(SETTINGS.job_queue_workers)
+        if SETTINGS.backfill_on_startup:
+            await self.backfill.run()
+
+    async def close(self) -> None:
+        await super().close()
+        await self.inference.aclose()
+
+    def start_job_workers(self, count: int) -> None:
+        logger.info(
+            f"Starting {count} job workers ({self.queue.count_unfinished()} jobs queued)"
+        )
+        self._workers = [
+            asyncio.create_task(self._job_worker(f"{os.getpid()}-worker-{i}"))
+            for i in range(count)
+        ]
 
     async def on_message(self, message: discord.Message):
         logger.debug("Received message!")
         if message.author == self.user:
             return
+        METRICS.messages_seen.inc()
 
-        user = User(
-            author_id=message.author.id,
-            author_nickname=message.author.nick if message.author.nick else None,
-            author_name=message.author.name,
-        )
-        self.db.upsert_user_info(user)
+        self.store_user(message.author)
         ctx = await self.get_context(message)
         if ctx.valid:
             await self.process_commands(message)
@@ -59,9 +143,11 @@ class DiscordBot(commands.Bot):
     async def breadstats(self, ctx: commands.Context, *args):
         """Get your previous stats for the breads you've posted
         Arguments:
-        --history : Shows a plot with
+        --history [--range 90d|12w|6m|2y|all] [--by post|week|month] [--page n] :
+            Shows a plot with your roundness over time (last 50 posts by default)
         --self : Shows your Best and worst
-        --top [n] : Shows the best and worst [n] results for the server"""
+        --top [n] : Shows the best and worst [n] results for the server
+        --server : Shows the bread stats of the whole server"""
         args = self.parse_message_args(ctx.message.content)
         if len(args) < 1:
             await ctx.channel.send(
@@ -74,6 +160,8 @@ class DiscordBot(commands.Bot):
             await self._breadstats_self(ctx, *args)
         elif args[0] == "--top":
             await self._breadstats_top(ctx, *args)
+        elif args[0] == "--server":
+            await self._breadstats_server(ctx, *args)
         else:
             await self._breadstats_top(ctx, *args)
 
@@ -96,18 +184,177 @@ class DiscordBot(commands.Bot):
                             """
         await ctx.channel.send(content=reply_content, reference=ctx.message)
 
+    @staticmethod
+    def parse_history_options(
+        args: list[str],
+    ) -> tuple[datetime | None, HistoryGranularity, int]:
+        """Parses the '--history' options into (since, granularity, page)
+
+        Raises:
+            ValueError: If any option or value is not valid
+        """
+        since = None
+        granularity = HistoryGranularity.POST
+        page = 1
+        options = iter(args)
+        for option in options:
+            value = next(options, None)
+            if value is None:
+                raise ValueError(f"Missing value for {option}")
+            if option == "--range":
+                if value == "all":
+                    since = None
+                    continue
+                match = re.fullmatch(r"(\d+)([dwmy])", value)
+                if match is None:
+                    raise ValueError(f"Invalid range {value}")
+                days = int(match.group(1)) * HISTORY_RANGE_UNITS[match.group(2)]
+                # Nothing is older than Discord: longer ranges are 'all' (and huge
+                # ones would overflow datetime)
+                if days >= (datetime.now(UTC) - DISCORD_EPOCH).days:
+                    since = None
+                else:
+                    since = datetime.now(UTC) - timedelta(days=days)
+            elif option == "--by":
+                granularity = HistoryGranularity(value)
+            elif option == "--page":
+                page = int(value)
+                # Past the last page the reply is empty anyway, and huge pages
+                # overflow the SQLite OFFSET
+                if not 1 <= page <= HISTORY_MAX_PAGE:
+                    raise ValueError(f"Invalid page {value}")
+            else:
+                raise ValueError(f"Unknown option {option}")
+        return since, granularity, page
+
     async def _breadstats_history(self, ctx: commands.Context, *args):
-        roundness_data = self.db.get_roundness_history(ctx.author.id)
+        try:
+            since, granularity, page = self.parse_history_options(list(args[1:]))
+        except ValueError as e:
+            logger.warning(e)
+            await ctx.channel.send(
+                content=f"{e}. Try something like --history --range 1y --by month",
+                reference=ctx.message,
+            )
+            return
         save_path = (
             SETTINGS.downloads_path / "plots" / f"{ctx.author.id}_roundhistory.png"
         )
-        plots.plot_roundness_by_user(roundness_data, save_path)
+        if granularity == HistoryGranularity.POST:
+            roundness_data = self.db.get_roundness_history(
+                ctx.author.id,
+                since=since,
+                limit=HISTORY_POSTS_PER_PAGE,
+                offset=(page - 1) * HISTORY_POSTS_PER_PAGE,
+            )
+        else:
+            roundness_data = self.db.get_roundness_history_buckets(
+                ctx.author.id,
+                granularity,
+                since=since,
+                limit=HISTORY_BUCKETS_PER_PAGE,
+                offset=(page - 1) * HISTORY_BUCKETS_PER_PAGE,
+            )
+        if not roundness_data:
+            await ctx.channel.send(
+                content="I couldn't find any bread from you in that range",
+                reference=ctx.message,
+            )
+            return
+        with TRACER.span("plot_render", METRICS.plot_render_seconds):
+            if granularity == HistoryGranularity.POST:
+                plots.plot_roundness_by_user(roundness_data, save_path)
+            else:
+                plots.plot_roundness_buckets_by_user(
+                    roundness_data, save_path, granularity
+                )
         discord_file = discord.File(save_path)
         reply_content = "Here's your graph with the roundness history"
         await ctx.channel.send(
             content=reply_content, reference=ctx.message, file=discord_file
         )
 
+    async def _breadstats_server(self, ctx: commands.Context, *args):
+        # Loading new rows and aggregating stays off the event loop
+        with TRACER.span("stats_snapshot_refresh"):
+            await asyncio.to_thread(self.snapshot.refresh)
+        stats = await asyncio.to_thread(
+            self.snapshot.compute_stats, SETTINGS.filter_bread_label_confidence
+        )
+        if stats.rated_posts == 0:
+            await ctx.channel.send(
+                content="No bread has been rated on this server yet",
+                reference=ctx.message,
+            )
+            return
+        percentiles = ", ".join(
+            f"p{pct}: {value * 100:.1f}%"
+            for pct, value in stats.roundness_percentiles.items()
+        )
+        lines = [
+            f"**Server bread stats** ({stats.rated_posts} rated of {stats.posts} posts)",
+            f"Average roundness: {stats.roundness_mean * 100:.2f}% ({percentiles})",
+            "**Roundness distribution:**",
+        ]
+        peak = max(stats.roundness_histogram)
+        for i, count in enumerate(stats.roundness_histogram):
+            low, high = stats.roundness_bin_edges[i], stats.roundness_bin_edges[i + 1]
+            bar = "█" * round(count / peak * 20) if peak else ""
+            lines.append(f"`{low * 100:3.0f}-{high * 100:3.0f}%` {bar} {count}")
+        lines.append("**Roundness by label:**")
+        for label, roundness in sorted(
+            stats.roundness_by_label.items(), key=lambda item: item[1], reverse=True
+        ):
+            lines.append(
+                f"{label.replace('_', ' ')}: {roundness * 100:.2f}% "
+                f"({stats.label_counts[label]} posts)"
+            )
+        if stats.label_pairs:
+            lines.append("**Labels seen together:**")
+            for first, second, count in stats.label_pairs:
+                lines.append(f"{first} + {second}: {count} posts")
+        lines.append("**Most active bakers:**")
+        for i, (author_id, posts, roundness) in enumerate(stats.top_bakers, start=1):
+            user_info = self._lookup_user_info(author_id)
+            lines.append(
+                f"#{i}: {user_info.author_name} with {posts} posts "
+                f"({roundness * 100:.2f}% round on average)"
+            )
+        reply_content = "\n".join(lines)
+        if len(reply_content) > DISCORD_MAX_CONTENT:
+            reply_content = reply_content[: DISCORD_MAX_CONTENT - 3] + "..."
+        await ctx.channel.send(content=reply_content, reference=ctx.message)
+
+    def store_user(self, author: discord.Member | discord.User) -> None:
+        """Saves the names of a poster, used by the leaderboards and the stats"""
+        user = User(
+            author_id=author.id,
+            author_nickname=getattr(author, "nick", None) or None,
+            author_name=author.name,
+        )
+        self._users[user.author_id] = user
+        try:
+            self.db.upsert_user_info(user)
+        except Exception as e:
+            # The message is still handled, the user info is refreshed on the next one
+            METRICS.errors.inc()
+            logger.error(f"Could not store user {user.author_id}: {e!r}")
+
+    def cache_users(self, users: list[User]) -> None:
+        self._users.update((user.author_id, user) for user in users)
+
+    def _lookup_user_info(self, author_id: int) -> User:
+        user_info = self._users.get(author_id)
+        if user_info is None:
+            try:
+                user_info = self.db.select_user_info(author_id)
+            except UserNotFound:
+                METRICS.cache_misses.inc()
+                return User(author_name="unknown", author_id=-1)
+            self._users[author_id] = user_info
+        METRICS.cache_hits.inc()
+        return user_info
+
     async def _breadstats_top(self, ctx: commands.Context, *args):
         # Return "top X" for the server
         try:
@@ -127,73 +374,285 @@ class DiscordBot(commands.Bot):
         # Generate message part for top X
         reply_content_max = f"Top {limit}{append_to_limit}:"
         for i, message in enumerate(results_max):
-            try:
-                user_info = self.db.select_user_info(message.author_id)
-            except UserNotFound:
-                user_info = User(author_name="unknown", author_id=-1)
+            user_info = self._lookup_user_info(message.author_id)
             reply_content_max = f"""{reply_content_max}\n #{i + 1}: {user_info.author_name} with {message.roundness * 100:.2f}% on message {message.replymessage_jump_url}"""
         # Generate message part for worst X
         reply_content_min = "Worst 3:"
         for i, message in enumerate(results_min):
-            try:
-                user_info = self.db.select_user_info(message.author_id)
-            except UserNotFound:
-                user_info = User(author_name="unknown", author_id=-1)
+            user_info = self._lookup_user_info(message.author_id)
             reply_content_min = f"""{reply_content_min}\n #{i + 1}: {user_info.author_name} with {message.roundness * 100:.2f}% on message {message.replymessage_jump_url}"""
 
         reply_content = f"{reply_content_max}\n{reply_content_min}"
         await ctx.channel.send(content=reply_content, reference=ctx.message)
 
+    async def breadbackfill(self, ctx: commands.Context, *args):
+        """Analyse the bread posts missed while the bot was offline (admins only)
+        Arguments:
+        [channel_id ...] : Only backfill these channels (all bread channels by default)"""
+        args = self.parse_message_args(ctx.message.content)
+        try:
+            channel_ids = [int(arg) for arg in args] or None
+        except ValueError:
+            await ctx.channel.send(
+                content="Channel ids have to be numbers", reference=ctx.message
+            )
+            return
+        await ctx.channel.send(
+            content="Looking for missed bread...", reference=ctx.message
+        )
+        try:
+            results = await self.backfill.run(channel_ids)
+        except BackfillAlreadyRunning:
+            await ctx.channel.send(
+                content="A backfill is already running", reference=ctx.message
+            )
+            return
+        summary = "\n".join(
+            f"<#{channel_id}>: {count} bread posts"
+            for channel_id, count in results.items()
+        )
+        await ctx.channel.send(
+            content=f"Backfill done!\n{summary}", reference=ctx.message
+        )
+
     async def hello(self, ctx: commands.Context, *args):
         """Say hello!"""
         await ctx.channel.send(content="Hello!", reference=ctx.message)
 
     async def predict(self, message: discord.Message):
-        """Main bread inference handler, gets all the relevant data and inserts in DB"""
+        """Main bread inference handler, checks the message and submits the bread work
+        (queued for the workers or processed right away)"""
         # Check Bread Candidate Message
+        with TRACER.trace("predict", message_id=message.id):
+            try:
+                if FreeMessageHandler.is_bread_candidate(message=message):
+                    METRICS.bread_candidates.inc()
+                    await self.submit_bread_work(
+                        ogmessage_id=message.id,
+                        channel_id=message.channel.id,
+                        guild_id=message.guild.id,
+                        min_confidence=SETTINGS.bread_detection_confidence,
+                        message=message,
+                    )
+                elif FreeMessageHandler.is_areyousure_message(
+                    message=message, botuser=self.user
+                ):
+                    logger.debug("Are you sure message! Do everything again!")
+                    # Timeline is:
+                    # User message with bread pic -> Bot reply -> User reply to bot reply; Invert to get OG message
+                    ogmessageref = message.reference.resolved.reference
+                    # TODO: double check that it the og message is a bread message?
+                    await self.submit_bread_work(
+                        ogmessage_id=ogmessageref.message_id,
+                        channel_id=ogmessageref.channel_id,
+                        guild_id=ogmessageref.guild_id,
+                        min_confidence=SETTINGS.override_detection_confidence,
+                    )
+
+            except Exception as e:
+                METRICS.errors.inc()
+                logger.error(e)
+
+    async def submit_bread_work(
+        self,
+        ogmessage_id: int,
+        channel_id: int,
+        guild_id: int,
+        min_confidence: float,
+        message: discord.Message | None = None,
+    ) -> None:
+        """Queues the bread message for the workers, or processes it right away when
+        the job queue is disabled"""
+        if self.queue is None:
+            # Queued jobs wait for the workers, which start after the warm-up
+            await self.warmup.ready.wait()
+            if message is None:
+                # For some reason it won't automatically resolve all replies so I have to do it manually
+                with TRACER.span("fetch_original_message"):
+                    message = await self.get_message_by_id(
+                        guild_id=guild_id,
+                        channel_id=channel_id,
+                        message_id=ogmessage_id,
+                    )
+            await self.process_bread_message(message, min_confidence)
+            return
+        trace = TRACER.current()
+        if self.queue.enqueue(
+            ogmessage_id,
+            channel_id,
+            guild_id,
+            min_confidence,
+            trace_id=trace.trace_id if trace is not None else None,
+        ):
+            if message is not None:
+                self._live_messages[ogmessage_id] = message
+            self._job_available.set()
+
+    async def _job_worker(self, worker: str) -> None:
+        while not self.is_closed():
+            # Cleared before claiming so an enqueue in between isn't missed
+            self._job_available.clear()
+            # Only jobs of the guilds this process is connected to
+            try:
+                job = self.queue.claim(
+                    worker, shard_count=self.shard_count, shard_ids=self.shard_ids
+                )
+            except Exception as e:
+                # The sharded deployment's writer can be briefly unreachable
+                METRICS.errors.inc()
+                logger.error(f"Worker {worker} could not claim a job: {e!r}")
+                await asyncio.sleep(SETTINGS.job_queue_poll_seconds)
+                continue
+            if job is None:
+                try:
+                    await asyncio.wait_for(
+                        self._job_available.wait(),
+                        timeout=SETTINGS.job_queue_poll_seconds,
+                    )
+                except TimeoutError:
+                    pass
+                continue
+            lease_keeper = asyncio.create_task(self._keep_lease(job))
+            # Continues the trace of the enqueuing message, from the enqueue time
+            with TRACER.trace(
+                "job",
+                message_id=job.ogmessage_id,
+                trace_id=job.trace_id,
+                started_at=job.created_at,
+            ):
+                try:
+                    message = self._live_messages.pop(job.ogmessage_id, None)
+                    if message is None:
+                        with TRACER.span("fetch_original_message"):
+                            message = await self.get_message_by_id(
+                                guild_id=job.guild_id,
+                                channel_id=job.channel_id,
+                                message_id=job.ogmessage_id,
+                            )
+                    await self.process_bread_message(message, job.min_confidence)
+                except Exception as e:
+                    METRICS.errors.inc()
+                    self._finish_job(job, error=repr(e))
+                else:
+                    self._finish_job(job)
+                finally:
+                    lease_keeper.cancel()
+
+    def _finish_job(self, job: Job, error: str | None = None) -> None:
+        # If the queue can't be updated the job's lease runs out and it's retried
+        try:
+            if error is None:
+                self.queue.complete(job)
+            else:
+                self.queue.fail(job, error)
+        except Exception as e:
+            METRICS.errors.inc()
+            logger.error(f"Could not update job {job.id}: {e!r}")
+
+    async def _keep_lease(self, job: Job) -> None:
+        """Renews the lease of the job while it's processed, so slow jobs (inference,
+        rate limits) aren't claimed again by another worker"""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                renewed = self.queue.renew_lease(job)
+            except Exception as e:
+                logger.error(f"Could not renew the lease of job {job.id}: {e!r}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost the lease of job {job.id}")
+                return
+
+    async def process_bread_message(
+        self, message: discord.Message, min_confidence: float
+    ) -> None:
+        """Downloads the pictures of a bread message, analyzes them and replies"""
 
         async def save_attachment(attachment: discord.Attachment) -> Path:
             save_path = SETTINGS.downloads_path / attachment.filename
-            await attachment.save(save_path)
+            with TRACER.span(
+                "download_attachment", METRICS.attachment_download_seconds
+            ):
+                await attachment.save(save_path)
             return save_path
 
-        try:
-            if FreeMessageHandler.is_bread_candidate(message=message):
-                saved_attachments = await asyncio.gather(
-                    *[save_attachment(a) for a in message.attachments]
+        saved_attachments = await asyncio.gather(
+            *[save_attachment(a) for a in message.attachments]
+        )
+        await self._reply_to_bread(
+            message=message,
+            input_files=saved_attachments,
+            min_confidence=min_confidence,
+        )
+
+    async def _reply_to_bread(
+        self,
+        message: discord.Message,
+        input_files: list[Path],
+        min_confidence: float,
+    ) -> None:
+        if SETTINGS.discord_reply_mode == "coalesced":
+            await self._send_coalesced_bread_message(
+                message=message, input_files=input_files, min_confidence=min_confidence
+            )
+            return
+        for file in input_files:
+            await self._send_bread_message(
+                input_file=file, message=message, min_confidence=min_confidence
+            )
+
+    async def _send_coalesced_bread_message(
+        self,
+        message: discord.Message,
+        input_files: list[Path],
+        min_confidence: float,
+    ) -> discord.Message:
+        """Analyzes all the pictures of a message and answers with a single reply
+        holding every result, then stores the roundest one"""
+        with METRICS.inflight_jobs.track_inprogress():
+            async with message.channel.typing():
+                results = await asyncio.gather(
+                    *[
+                        FreeMessageHandler.compute_bread_message_for_file(
+                            file, self.inference, min_confidence
+                        )
+                        for file in input_files[:DISCORD_MAX_FILES]
+                    ]
                 )
-                for file in saved_attachments:
-                    await self._send_bread_message(
-                        input_file=file,
-                        message=message,
-                        min_confidence=SETTINGS.bread_detection_confidence,
+                if len(results) == 1:
+                    comment = results[0][1]
+                else:
+                    comment = "\n".join(
+                        f"**#{i}:** {comment}"
+                        for i, (_, comment, _) in enumerate(results, start=1)
                     )
-            elif FreeMessageHandler.is_areyousure_message(
-                message=message, botuser=self.user
-            ):
-                logger.debug("Are you sure message! Do everything again!")
-                # Timeline is:
-                # User message with bread pic -> Bot reply -> User reply to bot reply; Invert to get OG message
-                ogmessageref = message.reference.resolved.reference
-                # For some reason it won't automatically resolve all replies so I have to do it manually
-                ogmessage = await self.get_message_by_id(
-                    guild_id=ogmessageref.guild_id,
-                    channel_id=ogmessageref.channel_id,
-                    message_id=ogmessageref.message_id,
-                )
-                saved_attachments = await asyncio.gather(
-                    *[save_attachment(a) for a in message.attachments]
-                )
-                # TODO: double check that it the og message is a bread message?
-                for file in saved_attachments:
-                    await self._send_bread_message(
-                        input_file=file,
-                        message=ogmessage,
-                        min_confidence=SETTINGS.override_detection_confidence,
+                if len(comment) > DISCORD_MAX_CONTENT:
+                    comment = comment[: DISCORD_MAX_CONTENT - 3] + "..."
+                with TRACER.span("discord_send", METRICS.discord_send_seconds):
+                    sent: discord.Message = await message.channel.send(
+                        files=[discord.File(out_file) for out_file, _, _ in results],
+                        content=comment,
+                        reference=message,
                     )
-
-        except Exception as e:
-            logger.error(e)
+            # The messages table has one row per post: it keeps the roundest picture
+            # (the one the leaderboards would pick), the others are only in the reply
+            best = max(
+                (prediction for _, _, prediction in results),
+                key=lambda p: (p.roundness is not None, p.roundness or 0.0),
+            )
+            self._store_result(
+                Message(
+                    ogmessage_id=message.id,
+                    replymessage_jump_url=sent.jump_url,
+                    replymessage_id=sent.id,
+                    author_id=message.author.id,
+                    channel_id=message.channel.id,
+                    guild_id=message.guild.id,
+                    roundness=best.roundness,
+                    labels_json=best.labels,
+                )
+            )
+        return sent
 
     async def _send_bread_message(
         self,
@@ -204,31 +663,41 @@ class DiscordBot(commands.Bot):
         """Main "bread analyze" function -> calls the compute function and sends message based on results"""
 
         # Download and process each attached picture
-        async with message.channel.typing():
-            # Compute: Get file (or None) and comment to be used
-            res = await FreeMessageHandler.compute_bread_message_for_file(
-                input_file, self.inference, min_confidence
-            )
-            out_file, comment, prediction = res
-            # Send the image back with the comment
-            sent: discord.Message = await message.channel.send(
-                file=discord.File(out_file), content=comment, reference=message
+        with METRICS.inflight_jobs.track_inprogress():
+            async with message.channel.typing():
+                # Compute: Get file (or None) and comment to be used
+                res = await FreeMessageHandler.compute_bread_message_for_file(
+                    input_file, self.inference, min_confidence
+                )
+                out_file, comment, prediction = res
+                # Send the image back with the comment
+                with TRACER.span("discord_send", METRICS.discord_send_seconds):
+                    sent: discord.Message = await message.channel.send(
+                        file=discord.File(out_file), content=comment, reference=message
+                    )
+            # One write, so readers (the stats snapshot) never see a half-filled row
+            self._store_result(
+                Message(
+                    ogmessage_id=message.id,
+                    replymessage_jump_url=sent.jump_url,
+                    replymessage_id=sent.id,
+                    author_id=message.author.id,
+                    channel_id=message.channel.id,
+                    guild_id=message.guild.id,
+                    roundness=prediction.roundness,
+                    labels_json=prediction.labels,
+                )
             )
-        self.db.upsert_message_stats(
-            ogmessage_id=message.id,
-            roundness=prediction.roundness,
-            labels_json=prediction.labels,
-        )
-        self.db.upsert_message_discordinfo(
-            ogmessage_id=message.id,
-            replymessage_jump_url=sent.jump_url,
-            replymessage_id=sent.id,
-            author_id=message.author.id,
-            channel_id=message.channel.id,
-            guild_id=message.guild.id,
-        )
         return sent
 
+    def _store_result(self, row: Message) -> None:
+        # The reply is already sent: failing the job here would only send it again
+        try:
+            self.db.upsert_messages([row])
+        except Exception as e:
+            METRICS.errors.inc()
+            logger.error(f"Could not store the result of {row.ogmessage_id}: {e!r}")
+
     async def get_message_by_id(
         self, guild_id: int, channel_id: int, message_id: int
     ) -> discord.Message:
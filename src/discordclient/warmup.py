@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime, timedelta
+from enum import StrEnum
+from typing import TYPE_CHECKING
+
+import discord
+from loguru import logger
+
+from db.models import RoundnessPoint
+from monitoring.metrics import METRICS
+from settings import SETTINGS
+from stats import plots
+
+if TYPE_CHECKING:
+    from .service import DiscordBot
+
+
+class WarmupState(StrEnum):
+    PENDING = "pending"
+    WARMING = "warming"
+    READY = "ready"
+
+
+class Warmup:
+    """Pays the cold costs of a fresh process before the bot accepts bread work:
+    inference connections, SQLite pages, user info of the recent posters, bread
+    channels and the first plot. A step that fails or times out is logged and the bot
+    becomes ready anyway"""
+
+    def __init__(self, bot: "DiscordBot"):
+        self.bot = bot
+        self.state = WarmupState.PENDING
+        # Seconds taken by each step
+        self.timings: dict[str, float] = {}
+        self.failures: dict[str, str] = {}
+        self.ready = asyncio.Event()
+
+    async def run(self) -> None:
+        self.state = WarmupState.WARMING
+        logger.info("Warm-up: started")
+        started = time.perf_counter()
+        steps: dict[str, Callable[[], Awaitable[None]]] = {
+            "inference": self._warm_inference,
+            "db": self._warm_db,
+            "recent_posters": self._warm_recent_posters,
+            "channels": self._warm_channels,
+        }
+        await asyncio.gather(
+            *[self._run_step(name, step) for name, step in steps.items()]
+        )
+        # Plotting runs on the loop thread (pyplot isn't thread-safe), alone so it
+        # doesn't hold up the other steps
+        await self._run_step("plots", self._warm_plots)
+        self.mark_ready(time.perf_counter() - started)
+
+    def mark_ready(self, duration: float = 0.0) -> None:
+        self.state = WarmupState.READY
+        METRICS.warmup_seconds.set(duration)
+        METRICS.ready.set(1)
+        self.ready.set()
+        logger.bind(warmup_timings=self.timings, warmup_failures=self.failures).info(
+            f"Warm-up: ready after {duration:.2f}s ("
+            + ", ".join(f"{name} {took:.2f}s" for name, took in self.timings.items())
+            + ")"
+            + (f", failed: {', '.join(self.failures)}" if self.failures else "")
+        )
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), timeout=SETTINGS.warmup_step_timeout_seconds)
+        except Exception as e:
+            self.failures[name] = repr(e)
+            logger.warning(f"Warm-up: step {name} failed: {e!r}")
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    async def _warm_inference(self) -> None:
+        await self.bot.inference.warm_up(SETTINGS.warmup_inference_connections)
+
+    async def _warm_db(self) -> None:
+        def prime() -> None:
+            # Index-backed reads only: the stats snapshot decodes every row, it's
+            # left to the first --server
+            self.bot.db.get_max_roundness_leaderboard(10)
+            self.bot.db.get_min_roundness_leaderboard(10)
+            self.bot.db.prime_indexes()
+
+        await asyncio.to_thread(prime)
+
+    async def _warm_recent_posters(self) -> None:
+        users = await asyncio.to_thread(
+            self.bot.db.select_recent_posters, SETTINGS.warmup_recent_posters
+        )
+        self.bot.cache_users(users)
+        logger.info(f"Warm-up: cached {len(users)} recent posters")
+
+    async def _warm_channels(self) -> None:
+        for channel_id in SETTINGS.discord_bread_channels:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                # In the sharded deployment, channels of other shards' guilds
+                logger.info(f"Warm-up: channel {channel_id} not available here")
+                continue
+            if channel.last_message_id is None:
+                continue
+            # Opens the REST connection and the rate limit bucket of the route used
+            # to fetch the original messages
+            try:
+                await channel.fetch_message(channel.last_message_id)
+            except discord.NotFound:
+                pass
+
+    async def _warm_plots(self) -> None:
+        # The first figure loads the fonts and the backend
+        now = datetime.now(UTC)
+        points = [
+            RoundnessPoint(
+                ogmessage_id=0, posted_at=now - timedelta(days=1), roundness=0.5
+            ),
+            RoundnessPoint(ogmessage_id=1, posted_at=now, roundness=0.7),
+        ]
+        save_path = SETTINGS.downloads_path / "plots" / "warmup.png"
+        plots.plot_roundness_by_user(points, save_path)
+        save_path.unlink(missing_ok=True)
@@ -1,9 +1,13 @@
+import asyncio
 import base64
 from pathlib import Path
 
 import httpx
 from pydantic import BaseModel
 
+from monitoring.metrics import METRICS
+from monitoring.tracing import TRACER
+
 
 class ImageData(BaseModel):
     image: str  # base64 encoded image
@@ -33,11 +37,34 @@ class PredictionError(Exception): ...
 
 class InferenceClient:
     def __init__(self, base_url: str):
-        self.client = lambda: httpx.AsyncClient(base_url=base_url)
+        self.base_url = base_url
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Shared, so the connections to the service stay open between predictions
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url)
+        return self._client
 
     async def predict(self, payload: ImageData) -> PredictResponse:
-        async with self.client() as client:
-            res = await client.post("/predict/predict", json=payload.model_dump())
-            if res.status_code != 200:
-                raise PredictionError()
-            return PredictResponse.model_validate(res.json())
+        with TRACER.span("inference", METRICS.inference_seconds):
+            res = await self.client.post("/predict/predict", json=payload.model_dump())
+        if res.status_code != 200:
+            raise PredictionError()
+        METRICS.predictions.inc()
+        return PredictResponse.model_validate(res.json())
+
+    async def warm_up(self, connections: int = 1) -> None:
+        """Opens 'connections' connections to the service with concurrent probes.
+        Any answer but a server error means the service is up"""
+        responses = await asyncio.gather(
+            *[self.client.get("/") for _ in range(connections)]
+        )
+        for res in responses:
+            if res.status_code >= 500:
+                raise PredictionError(f"Inference service answered {res.status_code}")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
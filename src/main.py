@@ -1,13 +1,103 @@
+import asyncio
 import os
+import signal
 
 from loguru import logger
 
-from registry import REGISTRY
+# REGISTRY is resolved when used, not at import: the spawned processes of the
+# sharded deployment import this module again and build their own Registry
+import registry
+from monitoring.server import MetricsApp, monitor_loop_lag, serve_metrics
+from settings import SETTINGS
+from sharding.runner import run_sharded
 
-if __name__ == "__main__":
+_background_tasks: set[asyncio.Task] = set()
+_stopping = False
+
+
+def prepare() -> None:
+    db, queue = registry.REGISTRY.db, registry.REGISTRY.queue
     logger.info("Startup: Creating DB")
-    REGISTRY.db.create_db()
+    db.create_db()
+    if queue is not None:
+        queue.create_table()
+        # Jobs that were running when the bot went down are replayed by the workers
+        released = queue.release_running()
+        logger.info(f"Startup: Replaying {released} interrupted jobs")
     logger.info("Startup: Creating Folders")
-    os.makedirs(REGISTRY.settings.downloads_path, exist_ok=True)
+    os.makedirs(SETTINGS.downloads_path, exist_ok=True)
+
+
+async def run_with_metrics() -> None:
+    """Runs the bot and the metrics endpoint on the same event loop"""
+    bot = registry.REGISTRY.bot
+    async with bot:
+        await asyncio.gather(
+            bot.start(SETTINGS.discord_token),
+            serve_metrics(SETTINGS.metrics_host, SETTINGS.metrics_port),
+            monitor_loop_lag(),
+        )
+
+
+async def _start_bot_in_background() -> None:
+    # Used when launched through uvicorn (see Dockerfile): uvicorn serves the
+    # metrics and the bot runs as a task on the same loop
+    if SETTINGS.shard_processes > 1:
+        raise RuntimeError(
+            "SHARD_PROCESSES > 1 needs the sharded runner: start with "
+            "'python src/main.py' instead of uvicorn"
+        )
+    prepare()
     logger.info("Startup: Starting Bot")
-    REGISTRY.bot.run(REGISTRY.settings.discord_token)
+    for coro in (
+        registry.REGISTRY.bot.start(SETTINGS.discord_token),
+        monitor_loop_lag(),
+    ):
+        task = asyncio.create_task(coro)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        task.add_done_callback(_on_background_task_done)
+
+
+def _on_background_task_done(task: asyncio.Task) -> None:
+    # The bot stopping on its own (bad token, login error, gateway crash) takes uvicorn
+    # down with it, rather than leaving the endpoints up with a dead bot
+    if _stopping or task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.opt(exception=error).error(f"Shutdown: {task.get_coro()} crashed")
+    else:
+        logger.error(f"Shutdown: {task.get_coro()} stopped unexpectedly")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def _stop_bot() -> None:
+    global _stopping
+    _stopping = True
+    logger.info("Shutdown: Closing Bot")
+    await registry.REGISTRY.bot.close()
+    for task in list(_background_tasks):
+        task.cancel()
+
+
+# Under uvicorn the HTTP server always runs (it hosts the bot); METRICS_ENABLED only
+# decides whether /metrics is served next to /ready
+app = MetricsApp(
+    on_startup=_start_bot_in_background,
+    on_shutdown=_stop_bot,
+    metrics_enabled=SETTINGS.metrics_enabled,
+)
+
+if __name__ == "__main__":
+    if SETTINGS.shard_processes > 1:
+        # The writer process prepares the database, the bot processes the folders
+        logger.info("Startup: Starting sharded deployment")
+        run_sharded(SETTINGS.shard_processes, SETTINGS.shard_count)
+    else:
+        prepare()
+        logger.info("Startup: Starting Bot")
+        if SETTINGS.metrics_enabled:
+            asyncio.run(run_with_metrics())
+        else:
+            registry.REGISTRY.bot.run(SETTINGS.discord_token)
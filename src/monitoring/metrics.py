@@ -0,0 +1,273 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name} {_format_value(self._value)}"]
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name} {_format_value(self._value)}"]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # One extra slot for the implicit +Inf bucket
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+            total_count = self._count
+        lines = self.header()
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            lines.append(
+                f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}'
+            )
+        lines.append(f"{self.name}_sum {_format_value(total_sum)}")
+        lines.append(f"{self.name}_count {total_count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register[M: Metric](self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Renders every registered metric in the Prometheus text exposition format"""
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics(MetricsRegistry):
+    """All the metrics exposed by the bot, grouped by pipeline stage"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Per-stage latencies
+        self.attachment_download_seconds = self.register(
+            Histogram(
+                "breadbot_attachment_download_seconds",
+                "Time spent downloading a Discord attachment",
+            )
+        )
+        self.inference_seconds = self.register(
+            Histogram(
+                "breadbot_inference_seconds",
+                "Round-trip time of a call to the inference service",
+            )
+        )
+        self.discord_send_seconds = self.register(
+            Histogram(
+                "breadbot_discord_send_seconds",
+                "Time spent sending a reply to Discord",
+            )
+        )
+        self.db_write_seconds = self.register(
+            Histogram(
+                "breadbot_db_write_seconds",
+                "Time spent on a single database write",
+            )
+        )
+        self.plot_render_seconds = self.register(
+            Histogram(
+                "breadbot_plot_render_seconds",
+                "Time spent rendering a stats plot",
+            )
+        )
+        # Counters
+        self.messages_seen = self.register(
+            Counter("breadbot_messages_seen_total", "Messages received by the bot")
+        )
+        self.bread_candidates = self.register(
+            Counter(
+                "breadbot_bread_candidates_total",
+                "Messages that passed the bread candidate checks",
+            )
+        )
+        self.predictions = self.register(
+            Counter(
+                "breadbot_predictions_total",
+                "Successful calls to the inference service",
+            )
+        )
+        self.errors = self.register(
+            Counter("breadbot_errors_total", "Errors raised while handling messages")
+        )
+        self.cache_hits = self.register(
+            Counter(
+                "breadbot_user_cache_hits_total",
+                "User lookups answered by the user cache or the discordusers table",
+            )
+        )
+        self.cache_misses = self.register(
+            Counter(
+                "breadbot_user_cache_misses_total",
+                "User lookups not found in the discordusers table",
+            )
+        )
+        # Gauges
+        self.event_loop_lag_seconds = self.register(
+            Gauge(
+                "breadbot_event_loop_lag_seconds",
+                "Delay between a scheduled event loop wakeup and the actual wakeup",
+            )
+        )
+        # Measured by the loop watchdog on its own heartbeat interval, separate from
+        # event_loop_lag_seconds so the two measurements don't overwrite each other
+        self.watchdog_heartbeat_lag_seconds = self.register(
+            Gauge(
+                "breadbot_watchdog_heartbeat_lag_seconds",
+                "Delay of the last loop watchdog heartbeat",
+            )
+        )
+        self.inflight_jobs = self.register(
+            Gauge(
+                "breadbot_inflight_jobs",
+                "Bread messages currently being processed",
+            )
+        )
+        self.ready = self.register(
+            Gauge(
+                "breadbot_ready",
+                "1 once the startup warm-up is done and bread work is accepted",
+            )
+        )
+        self.warmup_seconds = self.register(
+            Gauge("breadbot_warmup_seconds", "Duration of the startup warm-up")
+        )
+
+
+METRICS = BotMetrics()
@@ -0,0 +1,73 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+StackKey = tuple[str, ...]
+
+
+def format_stack(frame, limit: int = 12) -> StackKey:
+    """Turns a frame into a hashable tuple of 'file:line in function' entries, innermost last"""
+    entries = []
+    while frame is not None and len(entries) < limit:
+        code = frame.f_code
+        entries.append(f"{code.co_filename}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    return tuple(reversed(entries))
+
+
+def _is_idle(frame) -> bool:
+    # The event loop waiting on its selector means nothing is actually running
+    return frame.f_code.co_filename.endswith("selectors.py")
+
+
+class SamplingProfiler:
+    """Periodically samples the stack of a single thread (the event loop thread) from a
+    background thread. Every sample is added to all the registered collectors, so each
+    collector ends up with the hot stacks seen while it was registered"""
+
+    def __init__(self, interval: float = 0.01, stack_limit: int = 12):
+        self.interval = interval
+        self.stack_limit = stack_limit
+        self._target_thread_id: int | None = None
+        self._collectors: list[Counter[StackKey]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def register(self, collector: Counter[StackKey]) -> None:
+        with self._lock:
+            if self._target_thread_id is None:
+                self._target_thread_id = threading.get_ident()
+            self._collectors.append(collector)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="sampling-profiler", daemon=True
+                )
+                self._thread.start()
+            self._wakeup.set()
+
+    def unregister(self, collector: Counter[StackKey]) -> None:
+        # Once this returns the sampler thread won't touch the collector anymore
+        with self._lock:
+            self._collectors = [c for c in self._collectors if c is not collector]
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._collectors:
+                    self._wakeup.clear()
+                    idle = True
+                else:
+                    idle = False
+                    frame = sys._current_frames().get(self._target_thread_id)
+                    if frame is not None and not _is_idle(frame):
+                        stack = format_stack(frame, self.stack_limit)
+                        for collector in self._collectors:
+                            collector[stack] += 1
+                    del frame
+            if idle:
+                # Sleep until someone registers again instead of burning CPU
+                self._wakeup.wait()
+            else:
+                time.sleep(self.interval)
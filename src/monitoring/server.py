@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+
+import uvicorn
+from loguru import logger
+
+from .metrics import METRICS, MetricsRegistry
+
+LifespanHook = Callable[[], Awaitable[None]]
+
+
+class MetricsApp:
+    """Minimal ASGI app serving the metrics registry in the Prometheus text format,
+    and the bot readiness on /ready.
+    Optional startup/shutdown hooks are run on the ASGI lifespan events so the bot
+    can be started from uvicorn"""
+
+    content_type = b"text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = METRICS,
+        on_startup: LifespanHook | None = None,
+        on_shutdown: LifespanHook | None = None,
+        metrics_enabled: bool = True,
+    ):
+        self.registry = registry
+        # When disabled, /metrics answers 404 (only /ready is served)
+        self.metrics_enabled = metrics_enabled
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if self.on_startup:
+                    await self.on_startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.on_shutdown:
+                    await self.on_shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, send) -> None:
+        if scope["path"] == "/metrics" and self.metrics_enabled:
+            status = 200
+            body = self.registry.render().encode("utf-8")
+            content_type = self.content_type
+        elif scope["path"] == "/ready":
+            # For readiness probes: 503 until the bot has finished its warm-up
+            ready = METRICS.ready.value == 1
+            status = 200 if ready else 503
+            body = b"ready" if ready else b"warming up"
+            content_type = b"text/plain; charset=utf-8"
+        else:
+            status = 404
+            body = b"Not Found"
+            content_type = b"text/plain; charset=utf-8"
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", content_type)],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    """Measures how late the event loop wakes up compared to when it was asked to"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - start - interval
+        METRICS.event_loop_lag_seconds.set(max(lag, 0.0))
+
+
+async def serve_metrics(host: str, port: int) -> None:
+    """Serves the metrics endpoint on the running event loop (next to the bot)"""
+    config = uvicorn.Config(
+        MetricsApp(), host=host, port=port, log_level="warning", lifespan="off"
+    )
+    server = uvicorn.Server(config)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    await server.serve()
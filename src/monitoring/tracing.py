@@ -0,0 +1,180 @@
+import json
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from loguru import logger
+
+from .metrics import Histogram
+from .profiler import SamplingProfiler, StackKey
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float | None = None
+    error: str | None = None
+
+
+@dataclass
+class Trace:
+    """All the timed stages for a single message going through the bread pipeline"""
+
+    name: str
+    message_id: int | None
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    start: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    spans: list[Span] = field(default_factory=list)
+    samples: Counter[StackKey] = field(default_factory=Counter)
+
+    def breakdown(self) -> list[dict]:
+        return [
+            {
+                "span": s.name,
+                "offset_ms": round((s.start - self.start) * 1000, 2),
+                "duration_ms": None
+                if s.duration is None
+                else round(s.duration * 1000, 2),
+                "error": s.error,
+            }
+            for s in self.spans
+        ]
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.slow_threshold: float = 15.0
+        self.profiler: SamplingProfiler | None = None
+        self.profiler_top_stacks: int = 5
+        self._json_log_path: Path | None = None
+        self._json_sink_id: int | None = None
+
+    def configure(
+        self,
+        slow_threshold: float,
+        profiler_enabled: bool = False,
+        profiler_interval: float = 0.01,
+        json_log_path: Path | None = None,
+    ) -> None:
+        """Can be called again (several Registry in a process): the JSON sink is only
+        replaced when the path changes, so records are never written twice"""
+        self.slow_threshold = slow_threshold
+        self.profiler = (
+            SamplingProfiler(interval=profiler_interval) if profiler_enabled else None
+        )
+        if json_log_path == self._json_log_path:
+            return
+        if self._json_sink_id is not None:
+            logger.remove(self._json_sink_id)
+            self._json_sink_id = None
+        self._json_log_path = json_log_path
+        if json_log_path is not None:
+            json_log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._json_sink_id = logger.add(
+                json_log_path,
+                serialize=True,
+                filter=lambda record: "trace_id" in record["extra"],
+                enqueue=True,
+            )
+
+    @staticmethod
+    def current() -> Trace | None:
+        return _current_trace.get()
+
+    @contextmanager
+    def trace(
+        self,
+        name: str,
+        message_id: int | None = None,
+        trace_id: str | None = None,
+        started_at: float | None = None,
+    ):
+        """Starts a new trace for the current task. Tasks created inside
+        (asyncio.gather and friends) inherit it through the context.
+        A trace handed over between tasks (the job queue) is continued with its
+        'trace_id' and 'started_at' (a time.time() timestamp): the time in between is
+        recorded as a 'queue_wait' span and counts toward the duration"""
+        trace = Trace(name=name, message_id=message_id)
+        if trace_id is not None:
+            trace.trace_id = trace_id
+        if started_at is not None:
+            waited = max(time.time() - started_at, 0.0)
+            trace.start -= waited
+            trace.spans.append(
+                Span(name="queue_wait", start=trace.start, duration=waited)
+            )
+        token = _current_trace.set(trace)
+        if self.profiler:
+            self.profiler.register(trace.samples)
+        try:
+            # Every log call made while handling the message carries the trace id
+            with logger.contextualize(trace_id=trace.trace_id, message_id=message_id):
+                yield trace
+        finally:
+            if self.profiler:
+                self.profiler.unregister(trace.samples)
+            _current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.start
+            self._finish(trace)
+
+    @contextmanager
+    def span(self, name: str, histogram: Histogram | None = None):
+        """Times a stage of the pipeline. The duration is also observed in 'histogram'
+        if given, so the same block feeds both the trace and the metrics"""
+        trace = _current_trace.get()
+        span = Span(name=name, start=time.perf_counter())
+        if trace is not None:
+            trace.spans.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            if histogram is not None:
+                histogram.observe(span.duration)
+            if trace is not None:
+                logger.bind(
+                    trace_id=trace.trace_id,
+                    message_id=trace.message_id,
+                    span=span.name,
+                    duration_ms=round(span.duration * 1000, 2),
+                    error=span.error,
+                ).debug(f"[{trace.trace_id}] {span.name} took {span.duration:.3f}s")
+
+    def _finish(self, trace: Trace) -> None:
+        record = logger.bind(
+            trace_id=trace.trace_id,
+            message_id=trace.message_id,
+            trace=trace.name,
+            duration_ms=round(trace.duration * 1000, 2),
+            spans=trace.breakdown(),
+        )
+        if trace.duration < self.slow_threshold:
+            record.debug(f"[{trace.trace_id}] {trace.name} took {trace.duration:.3f}s")
+            return
+        record.warning(
+            f"[{trace.trace_id}] Slow {trace.name} for message {trace.message_id}: "
+            f"{trace.duration:.3f}s (threshold {self.slow_threshold}s)\n"
+            + json.dumps(trace.breakdown(), indent=2)
+        )
+        if trace.samples:
+            total = sum(trace.samples.values())
+            for stack, count in trace.samples.most_common(self.profiler_top_stacks):
+                logger.bind(trace_id=trace.trace_id, samples=count).warning(
+                    f"[{trace.trace_id}] Hot stack ({count}/{total} samples):\n"
+                    + "\n".join(f"  {entry}" for entry in stack)
+                )
+
+
+TRACER = Tracer()
@@ -0,0 +1,109 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+
+from loguru import logger
+
+from .metrics import METRICS
+from .profiler import StackKey, format_stack
+
+
+class LoopWatchdog:
+    """Detects callbacks blocking the event loop. A task on the loop keeps updating a
+    heartbeat; a background thread checks it and, when the loop hasn't come back for
+    longer than 'threshold', captures the stack of the loop thread: that's the code
+    that is blocking it. Blocking call sites are counted so the worst ones stand out"""
+
+    def __init__(
+        self,
+        threshold: float = 0.25,
+        interval: float = 0.05,
+        stack_limit: int = 15,
+        project_root: str | None = None,
+        summary_interval: float = 300,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.stack_limit = stack_limit
+        # Call sites are attributed to the innermost frame from this directory
+        self.project_root = project_root
+        self.summary_interval = summary_interval
+        self.call_sites: Counter[str] = Counter()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    async def run(self) -> None:
+        """Runs the heartbeat on the current loop and starts the watchdog thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+        last_summary = time.monotonic()
+        try:
+            while True:
+                before = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                METRICS.watchdog_heartbeat_lag_seconds.set(
+                    max(now - before - self.interval, 0.0)
+                )
+                if now - last_summary > self.summary_interval:
+                    last_summary = now
+                    self._log_summary()
+        finally:
+            self._stopped.set()
+
+    def _watch(self) -> None:
+        # Heartbeat value already reported, so one stall is only logged once
+        reported: float | None = None
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat
+            if stalled_for < self.threshold or reported == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = format_stack(frame, self.stack_limit)
+            del frame
+            reported = heartbeat
+            self._report(stack, stalled_for)
+
+    def _call_site(self, stack: StackKey) -> str:
+        if self.project_root:
+            for entry in reversed(stack):
+                if entry.startswith(self.project_root):
+                    return entry
+        return stack[-1] if stack else "unknown"
+
+    def _report(self, stack: StackKey, stalled_for: float) -> None:
+        call_site = self._call_site(stack)
+        self.call_sites[call_site] += 1
+        logger.bind(
+            blocking_call_site=call_site,
+            blocked_ms=round(stalled_for * 1000, 2),
+            occurrences=self.call_sites[call_site],
+        ).warning(
+            f"Event loop blocked for {stalled_for:.3f}s+ at {call_site} "
+            f"(seen {self.call_sites[call_site]} times):\n"
+            + "\n".join(f"  {entry}" for entry in stack)
+        )
+
+    def summary(self, top: int = 10) -> list[tuple[str, int]]:
+        return self.call_sites.most_common(top)
+
+    def _log_summary(self) -> None:
+        if not self.call_sites:
+            return
+        logger.info(
+            "Event loop blocking call sites so far:\n"
+            + "\n".join(f"  {count:>5}x {site}" for site, count in self.summary())
+        )
@@ -1,15 +1,71 @@
+from pathlib import Path
+
+from db.queue import JobQueue
 from db.service import DBService
 from discordclient.service import DiscordBot
 from inference.predict import InferenceClient
+from monitoring.tracing import TRACER
+from monitoring.watchdog import LoopWatchdog
 from settings import SETTINGS
+from sharding.client import WriterClient, WriteRouter
 
 
 class Registry:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        writer: WriterClient | None = None,
+        shard_ids: list[int] | None = None,
+        shard_count: int | None = None,
+    ) -> None:
         self.settings = SETTINGS
-        self.db = DBService(str(self.settings.db_data_path))
+        TRACER.configure(
+            slow_threshold=self.settings.trace_slow_threshold_seconds,
+            profiler_enabled=self.settings.trace_profiler_enabled,
+            profiler_interval=self.settings.trace_profiler_interval_seconds,
+            json_log_path=self.settings.trace_log_path,
+        )
+        # Bot processes of the sharded deployment read through read-only connections
+        # and send their writes to the writer process
+        self.db = DBService(
+            str(self.settings.db_data_path), read_only=writer is not None
+        )
         self.inference = InferenceClient(self.settings.inference_service_url)
-        self.bot = DiscordBot(self.db, self.inference)
+        self.queue = (
+            JobQueue(
+                self.db,
+                lease_seconds=self.settings.job_queue_lease_seconds,
+                max_attempts=self.settings.job_queue_max_attempts,
+            )
+            if self.settings.job_queue_enabled
+            else None
+        )
+        if writer is not None:
+            self.db = WriteRouter(self.db, writer, "db")
+            if self.queue is not None:
+                self.queue = WriteRouter(self.queue, writer, "queue")
+        self.watchdog = (
+            LoopWatchdog(
+                threshold=self.settings.loop_watchdog_threshold_seconds,
+                project_root=str(Path(__file__).parent),
+            )
+            if self.settings.loop_watchdog_enabled
+            else None
+        )
+        self.bot = DiscordBot(
+            self.db,
+            self.inference,
+            self.queue,
+            self.watchdog,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+        )
 
 
-REGISTRY = Registry()
+def __getattr__(name: str):
+    # REGISTRY is built on first import, so the sharded processes can build their own
+    # Registry without wiring the default one
+    if name == "REGISTRY":
+        global REGISTRY
+        REGISTRY = Registry()
+        return REGISTRY
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
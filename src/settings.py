@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -15,12 +16,64 @@ class Settings(BaseSettings):
     discord_token: str
     discord_bread_channels: list[int]
     discord_bread_role: list[int]
+    # "per_attachment": one reply per picture, "coalesced": one reply per post
+    discord_reply_mode: Literal["per_attachment", "coalesced"] = "per_attachment"
 
     db_data_path: Path = Path("dbdata/messages.db")
     downloads_path: Path = Path("downloads/")
 
     inference_service_url: str = "http://localhost:8000"
 
+    # Durable job queue for bread predictions (stored in the bot database)
+    job_queue_enabled: bool = True
+    job_queue_workers: int = 2
+    job_queue_lease_seconds: float = 300
+    job_queue_max_attempts: int = 3
+    job_queue_poll_seconds: float = 5
+
+    # Warm-up run on the first on_ready, before the bread work is accepted
+    warmup_enabled: bool = True
+    # Each step gives up after this long, the bot becomes ready anyway
+    warmup_step_timeout_seconds: float = 30
+    warmup_inference_connections: int = 2
+    warmup_recent_posters: int = 200
+
+    # Catch-up of the bread posts missed while offline
+    backfill_on_startup: bool = False
+    backfill_concurrency: int = 2
+    backfill_page_size: int = 100
+    backfill_page_delay_seconds: float = 1.0
+    # How far back to look in channels without any analysed message
+    backfill_max_age_days: int = 30
+
+    # The server stats snapshot is rebuilt from scratch this often to pick up updated rows
+    stats_snapshot_full_refresh_seconds: float = 3600
+    # Each refresh re-reads the posts this recent, which may be written out of order
+    stats_snapshot_reread_seconds: float = 900
+
+    # Sharded deployment: several bot processes, each connected to a subset of the
+    # gateway shards, with all the database writes going through one writer process
+    shard_processes: int = 1
+    # Total number of gateway shards, one per process by default
+    shard_count: int | None = None
+    db_writer_host: str = "127.0.0.1"
+    db_writer_port: int = 9100
+
+    # Prometheus metrics endpoint served next to the bot
+    metrics_enabled: bool = False
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 9000
+
+    # Per-message tracing: slow requests log their full span breakdown
+    trace_slow_threshold_seconds: float = 15.0
+    trace_log_path: Path | None = None
+    trace_profiler_enabled: bool = False
+    trace_profiler_interval_seconds: float = 0.01
+
+    # Logs the stack of whatever blocks the event loop longer than the threshold
+    loop_watchdog_enabled: bool = False
+    loop_watchdog_threshold_seconds: float = 0.25
+
     model_config = SettingsConfigDict(env_prefix="__", env_file=".env")
 
     @field_validator("discord_bread_channels", "discord_bread_role", mode="before")
@@ -30,7 +83,7 @@ class Settings(BaseSettings):
             return [int(x.strip()) for x in v.split(",") if x.strip()]
         return v
 
-    @field_validator("db_data_path", "downloads_path", mode="before")
+    @field_validator("db_data_path", "downloads_path", "trace_log_path", mode="before")
     def parse_path(cls, v):
         return Path(v) if isinstance(v, str) else v
 
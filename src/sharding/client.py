@@ -0,0 +1,84 @@
+import functools
+import threading
+import time
+from multiprocessing.connection import Client, Connection
+
+from db.service import is_db_write
+from monitoring.metrics import METRICS
+from monitoring.tracing import TRACER
+
+Address = tuple[str, int]
+
+
+class WriterUnavailable(Exception): ...
+
+
+class WriterClient:
+    """Connection of a bot process to the database writer. Calls are blocking round
+    trips, like the sqlite calls they replace; the lock keeps the requests made from
+    other threads (asyncio.to_thread) from interleaving on the connection"""
+
+    def __init__(
+        self,
+        address: Address,
+        authkey: bytes,
+        connect_attempts: int = 50,
+        connect_delay: float = 0.1,
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.connect_attempts = connect_attempts
+        self.connect_delay = connect_delay
+        self._conn: Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        for _ in range(self.connect_attempts):
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except ConnectionRefusedError:
+                time.sleep(self.connect_delay)
+        raise WriterUnavailable(f"No database writer listening on {self.address}")
+
+    def call(self, target: str, method: str, *args, **kwargs):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            try:
+                self._conn.send((target, method, args, kwargs))
+                status, result = self._conn.recv()
+            except (EOFError, OSError) as e:
+                # Reconnects on the next call
+                self._conn = None
+                raise WriterUnavailable(f"Lost the database writer: {e!r}") from e
+        if status == "error":
+            raise result
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class WriteRouter:
+    """Stands in for a DBService or a JobQueue in a bot process: the db_write methods
+    are sent to the writer process, everything else runs on the wrapped local instance
+    (which has a read-only connection). The forwarded writes are timed here: the
+    writer process has neither the metrics endpoint nor the traces"""
+
+    def __init__(self, local: object, writer: WriterClient, target: str):
+        self._local = local
+        self._writer = writer
+        self._target = target
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._local, name)
+        if callable(attr) and is_db_write(attr):
+            return functools.partial(self._call, name)
+        return attr
+
+    def _call(self, name: str, *args, **kwargs):
+        with TRACER.span(f"db.{name}", METRICS.db_write_seconds):
+            return self._writer.call(self._target, name, *args, **kwargs)
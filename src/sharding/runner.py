@@ -0,0 +1,210 @@
+"""Sharded deployment: one database writer process and several bot processes, each
+connected to a subset of the gateway shards.
+
+Started by main.py when SHARD_PROCESSES > 1. To try it locally without Discord, the
+bot processes can be replaced by stand-in gateways generating synthetic bread posts:
+
+    PYTHONPATH=src python -m sharding.runner --standin --processes 4 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import secrets
+from multiprocessing.connection import wait
+from multiprocessing.synchronize import Event
+from queue import Empty
+
+from loguru import logger
+
+from db.queue import JobQueue
+from db.service import DBService
+from monitoring.server import monitor_loop_lag, serve_metrics
+from settings import SETTINGS
+
+from .client import Address, WriterClient, WriteRouter
+from .standin import StandInGateway
+from .writer import DBWriter
+
+
+def assign_shards(shard_count: int, processes: int) -> list[list[int]]:
+    return [list(range(shard_count))[i::processes] for i in range(processes)]
+
+
+def _new_queue(db: DBService) -> JobQueue:
+    return JobQueue(
+        db,
+        lease_seconds=SETTINGS.job_queue_lease_seconds,
+        max_attempts=SETTINGS.job_queue_max_attempts,
+    )
+
+
+def run_writer(address: Address, authkey: bytes, ready: Event) -> None:
+    db = DBService(str(SETTINGS.db_data_path))
+    queue = _new_queue(db) if SETTINGS.job_queue_enabled else None
+    writer = DBWriter(db, queue)
+    writer.prepare()
+    writer.serve(address, authkey, ready)
+
+
+def run_bot(
+    index: int,
+    shard_ids: list[int],
+    shard_count: int,
+    address: Address,
+    authkey: bytes,
+) -> None:
+    from registry import Registry
+
+    logger.info(f"Bot process {index}: shards {shard_ids} of {shard_count}")
+    registry = Registry(
+        writer=WriterClient(address, authkey),
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+    )
+    os.makedirs(registry.settings.downloads_path, exist_ok=True)
+    if not registry.settings.metrics_enabled:
+        registry.bot.run(registry.settings.discord_token)
+        return
+
+    async def run_with_metrics() -> None:
+        async with registry.bot:
+            await asyncio.gather(
+                registry.bot.start(registry.settings.discord_token),
+                serve_metrics(
+                    registry.settings.metrics_host,
+                    registry.settings.metrics_port + index,
+                ),
+                monitor_loop_lag(),
+            )
+
+    asyncio.run(run_with_metrics())
+
+
+def run_standin(
+    index: int,
+    shard_ids: list[int],
+    shard_count: int,
+    address: Address,
+    authkey: bytes,
+    duration: float,
+    results: multiprocessing.Queue,
+) -> None:
+    writer = WriterClient(address, authkey)
+    db = DBService(str(SETTINGS.db_data_path), read_only=True)
+    gateway = StandInGateway(
+        WriteRouter(db, writer, "db"),
+        WriteRouter(_new_queue(db), writer, "queue"),
+        process_index=index,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+    )
+    results.put(gateway.run(duration))
+
+
+def _drain(results: multiprocessing.Queue) -> list[dict]:
+    reports = []
+    while True:
+        try:
+            reports.append(results.get_nowait())
+        except Empty:
+            return reports
+
+
+def run_sharded(
+    processes: int,
+    shard_count: int | None = None,
+    standin_duration: float | None = None,
+) -> list[dict]:
+    """Starts the writer, then the bot processes (or stand-in gateways when
+    'standin_duration' is set) and waits for them, stopping them all if the writer
+    exits. Returns the stand-in reports"""
+    shard_count = shard_count or processes
+    if shard_count < processes:
+        raise ValueError(f"{processes} processes need at least as many shards")
+    if standin_duration is not None and not SETTINGS.job_queue_enabled:
+        raise ValueError("The stand-in gateways go through the job queue")
+    context = multiprocessing.get_context("spawn")
+    address = (SETTINGS.db_writer_host, SETTINGS.db_writer_port)
+    # Only the processes started here can talk to the writer
+    authkey = secrets.token_bytes(32)
+    ready = context.Event()
+    writer = context.Process(
+        target=run_writer, args=(address, authkey, ready), name="db-writer", daemon=True
+    )
+    writer.start()
+    if not ready.wait(timeout=60):
+        writer.terminate()
+        raise RuntimeError("The database writer didn't start")
+
+    results = context.Queue()
+    workers = []
+    for index, shard_ids in enumerate(assign_shards(shard_count, processes)):
+        if standin_duration is None:
+            target, args = run_bot, (index, shard_ids, shard_count, address, authkey)
+        else:
+            target = run_standin
+            args = (
+                index,
+                shard_ids,
+                shard_count,
+                address,
+                authkey,
+                standin_duration,
+                results,
+            )
+        worker = context.Process(target=target, args=args, name=f"bot-{index}")
+        worker.start()
+        workers.append(worker)
+
+    reports = []
+    try:
+        while any(worker.is_alive() for worker in workers):
+            wait(
+                [writer.sentinel]
+                + [worker.sentinel for worker in workers if worker.is_alive()],
+                timeout=1,
+            )
+            # Read while waiting, a process with queued data doesn't exit
+            reports += _drain(results)
+            if not writer.is_alive():
+                # The bots can no longer write: stop them all so the deployment's
+                # supervisor restarts everything
+                logger.error(f"The database writer exited ({writer.exitcode})")
+                raise RuntimeError("The database writer died")
+        reports += _drain(results)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        writer.terminate()
+    return sorted(reports, key=lambda report: report["process"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--processes", type=int, default=SETTINGS.shard_processes)
+    parser.add_argument("--shards", type=int, default=SETTINGS.shard_count)
+    parser.add_argument(
+        "--standin",
+        action="store_true",
+        help="Run stand-in gateways with synthetic traffic instead of Discord",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="Stand-in run time in seconds"
+    )
+    args = parser.parse_args()
+    reports = run_sharded(
+        args.processes, args.shards, args.duration if args.standin else None
+    )
+    for report in reports:
+        logger.info(f"Stand-in gateway report:\n{json.dumps(report, indent=2)}")
+    if reports:
+        total = sum(report["posts_per_s"] for report in reports)
+        logger.info(f"Stand-in gateways: {total:.1f} posts/s in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import UTC, datetime
+
+from db.models import Message, User, datetime_to_snowflake
+from db.queue import JobQueue
+from db.service import DBService, UserNotFound
+
+LABELS = ["bread", "sourdough", "baguette", "brioche", "focaccia"]
+
+
+def guild_on_shard(shard_id: int, shard_count: int, n: int = 0) -> int:
+    """Id of the n-th made-up guild that Discord would put on this shard"""
+    return (shard_id + n * shard_count + shard_count) << 22
+
+
+class StandInGateway:
+    """Replaces the Discord gateway of a bot process to try the sharded deployment
+    locally: posts bread on guilds of its own shards and runs them through the same
+    database path as the bot (user upsert, job queue, message upsert and the stats
+    reads), without Discord nor the inference service"""
+
+    def __init__(
+        self,
+        db: DBService,
+        queue: JobQueue,
+        process_index: int,
+        shard_ids: list[int],
+        shard_count: int,
+        users: int = 50,
+        reads_every: int = 5,
+        seed: int = 0,
+    ):
+        self.db = db
+        self.queue = queue
+        self.process_index = process_index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.guilds = [
+            guild_on_shard(s, shard_count, n) for s in shard_ids for n in (0, 1)
+        ]
+        self.users = [10**17 + i for i in range(users)]
+        self.reads_every = reads_every
+        self.rng = random.Random(seed + process_index)
+        self.counts: Counter[str] = Counter()
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self._sequence = 0
+
+    def _next_message_id(self) -> int:
+        # The low bits of a snowflake are free for the process and a sequence number,
+        # so ids never collide between stand-in processes
+        self._sequence += 1
+        return (
+            datetime_to_snowflake(datetime.now(UTC))
+            | (self.process_index % 32) << 17
+            | self._sequence % (1 << 17)
+        )
+
+    def _timed(self, name: str, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except UserNotFound:
+            return None
+        except Exception:
+            self.counts["errors"] += 1
+            raise
+        finally:
+            self.latencies[name].append(time.perf_counter() - start)
+
+    def post(self) -> None:
+        author_id = self.rng.choice(self.users)
+        guild_id = self.rng.choice(self.guilds)
+        ogmessage_id = self._next_message_id()
+        self._timed(
+            "upsert_user_info",
+            self.db.upsert_user_info,
+            User(author_id=author_id, author_name=f"baker{author_id % 1000}"),
+        )
+        self._timed(
+            "enqueue", self.queue.enqueue, ogmessage_id, guild_id, guild_id, 0.5
+        )
+        job = self._timed(
+            "claim",
+            self.queue.claim,
+            f"standin-{self.process_index}",
+            shard_count=self.shard_count,
+            shard_ids=self.shard_ids,
+        )
+        if job is None:
+            return
+        if (job.guild_id >> 22) % self.shard_count not in self.shard_ids:
+            self.counts["foreign_jobs"] += 1
+        labels = {name: self.rng.random() for name in self.rng.sample(LABELS, 2)}
+        self._timed(
+            "upsert_messages",
+            self.db.upsert_messages,
+            [
+                Message(
+                    ogmessage_id=job.ogmessage_id,
+                    replymessage_jump_url="",
+                    replymessage_id=job.ogmessage_id + 1,
+                    author_id=author_id,
+                    channel_id=job.channel_id,
+                    guild_id=job.guild_id,
+                    roundness=self.rng.random(),
+                    labels_json=labels,
+                )
+            ],
+        )
+        self._timed("complete", self.queue.complete, job)
+        self.counts["posts"] += 1
+
+    def read(self) -> None:
+        author_id = self.rng.choice(self.users)
+        self._timed("leaderboard", self.db.get_max_roundness_leaderboard, 5)
+        self._timed("history", self.db.get_roundness_history, author_id)
+        self._timed("select_user_info", self.db.select_user_info, author_id)
+        self.counts["reads"] += 1
+
+    def run(self, duration: float) -> dict:
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            self.post()
+            if self.counts["posts"] % self.reads_every == 0:
+                self.read()
+        return self.report(duration)
+
+    def report(self, duration: float) -> dict:
+        latencies_ms = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            latencies_ms[name] = {
+                "p50": values[len(values) // 2] * 1000,
+                "p99": values[min(int(len(values) * 0.99), len(values) - 1)] * 1000,
+            }
+        return {
+            "process": self.process_index,
+            "shards": self.shard_ids,
+            "posts_per_s": self.counts["posts"] / duration,
+            "counts": dict(self.counts),
+            "latency_ms": latencies_ms,
+        }
@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+from multiprocessing.connection import Connection, Listener
+from multiprocessing.synchronize import Event
+
+from loguru import logger
+
+from db.queue import JobQueue
+from db.service import DBService, is_db_write
+
+from .client import Address
+
+
+class DBWriter:
+    """Owns the write side of the database in the sharded deployment. The bot processes
+    send the calls to db_write methods over a local connection; they are run one at a
+    time here, so SQLite only ever sees a single writer and no process waits on a lock"""
+
+    def __init__(self, db: DBService, queue: JobQueue | None = None):
+        self.targets: dict[str, object] = {"db": db}
+        if queue is not None:
+            self.targets["queue"] = queue
+        self._lock = threading.Lock()
+
+    def prepare(self) -> None:
+        """Same as main.prepare for the database, before any bot process connects"""
+        db: DBService = self.targets["db"]
+        db.create_db()
+        queue: JobQueue | None = self.targets.get("queue")
+        if queue is not None:
+            queue.create_table()
+            released = queue.release_running()
+            logger.info(f"DB writer: Replaying {released} interrupted jobs")
+
+    def call(self, target: str, method: str, args: tuple, kwargs: dict):
+        func = getattr(self.targets.get(target), method, None)
+        if func is None or not is_db_write(func):
+            raise PermissionError(f"{target}.{method} is not a database write")
+        with self._lock:
+            return func(*args, **kwargs)
+
+    def serve(
+        self, address: Address, authkey: bytes, ready: Event | None = None
+    ) -> None:
+        # Keeps the WAL files around while the writer runs: they're removed when the
+        # last connection closes, and the read-only connections can't create them
+        keepalive = sqlite3.connect(self.targets["db"].db_url)
+        try:
+            with Listener(address, authkey=authkey) as listener:
+                logger.info(f"DB writer listening on {address[0]}:{address[1]}")
+                if ready is not None:
+                    ready.set()
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except Exception as e:
+                        logger.warning(f"DB writer: rejected a connection: {e!r}")
+                        continue
+                    threading.Thread(
+                        target=self._handle, args=(conn,), daemon=True
+                    ).start()
+        finally:
+            keepalive.close()
+
+    def _handle(self, conn: Connection) -> None:
+        with conn:
+            while True:
+                try:
+                    target, method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = ("ok", self.call(target, method, args, kwargs))
+                except Exception as e:
+                    logger.error(f"DB writer: {target}.{method} failed: {e!r}")
+                    response = ("error", e)
+                conn.send(response)
@@ -4,12 +4,15 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from db.models import RoundnessBucket, RoundnessPoint
 
-def plot_roundness_by_user(data, filepath: Path):
-    # Data: list of tuples with (X, Y) values
-    x_values, y_values = zip(*data)
+
+def plot_roundness_by_user(data: list[RoundnessPoint], filepath: Path):
+    # Data: one point per post, in any order
+    data = sorted(data, key=lambda point: point.posted_at)
+    x_values = [point.posted_at for point in data]
     # Scale Y values to percentages
-    y_values_percent = [y * 100 for y in y_values]
+    y_values_percent = [point.roundness * 100 for point in data]
 
     sns.set(style="darkgrid", context="talk")
     plt.figure(figsize=(12, 7))
@@ -24,10 +27,62 @@ def plot_roundness_by_user(data, filepath: Path):
     sns.scatterplot(x=x_values, y=y_values_percent, color="orange", s=100, zorder=5)
 
     # Set the plot labels and title
-    plt.xlabel("X", fontsize=14, fontweight="bold")
-    plt.ylabel("Y (%)", fontsize=14, fontweight="bold")
+    plt.xlabel("Posted", fontsize=14, fontweight="bold")
+    plt.ylabel("Roundness (%)", fontsize=14, fontweight="bold")
     plt.title("Amazing roundness history for User", fontsize=18, fontweight="bold")
+    plt.gcf().autofmt_xdate()
+
+    _save(filepath)
+
+
+def plot_roundness_buckets_by_user(
+    data: list[RoundnessBucket], filepath: Path, granularity: str
+):
+    # Data: one aggregate per week/month, in any order
+    data = sorted(data, key=lambda bucket: bucket.bucket_start)
+    x_values = [bucket.bucket_start for bucket in data]
+
+    sns.set(style="darkgrid", context="talk")
+    plt.figure(figsize=(12, 7))
+    plt.fill_between(
+        x_values,
+        [bucket.min * 100 for bucket in data],
+        [bucket.max * 100 for bucket in data],
+        color="teal",
+        alpha=0.2,
+        label="Min - Max",
+    )
+    sns.lineplot(
+        x=x_values,
+        y=[bucket.mean * 100 for bucket in data],
+        marker="o",
+        color="teal",
+        linewidth=2.5,
+        label="Mean",
+    )
+    sns.lineplot(
+        x=x_values,
+        y=[bucket.rolling_mean * 100 for bucket in data],
+        color="orange",
+        linewidth=2.5,
+        linestyle="--",
+        label="Rolling mean",
+    )
+
+    plt.xlabel(granularity.capitalize(), fontsize=14, fontweight="bold")
+    plt.ylabel("Roundness (%)", fontsize=14, fontweight="bold")
+    plt.title(
+        f"Amazing roundness history for User (per {granularity})",
+        fontsize=18,
+        fontweight="bold",
+    )
+    plt.gcf().autofmt_xdate()
+
+    _save(filepath)
+
 
+def _save(filepath: Path):
     # Save the plot as a PNG image
     os.makedirs(filepath.parent, exist_ok=True)
     plt.savefig(filepath.as_posix(), dpi=300, bbox_inches="tight")
+    plt.close()
@@ -0,0 +1,214 @@
+import json
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from db.service import DBService
+
+
+class ServerStats(BaseModel):
+    posts: int
+    rated_posts: int
+    roundness_mean: float
+    roundness_percentiles: dict[int, float]
+    # Counts per roundness bin, edges go from 0 to 1
+    roundness_histogram: list[int]
+    roundness_bin_edges: list[float]
+    label_counts: dict[str, int]
+    roundness_by_label: dict[str, float]
+    # Most common pairs of labels found in the same post
+    label_pairs: list[tuple[str, str, int]]
+    # (author_id, posts, mean roundness)
+    top_bakers: list[tuple[int, int, float]]
+
+
+class MessageSnapshot:
+    """Columnar copy of the messages table in NumPy arrays for server-wide aggregates.
+    Rows aren't written in id order (concurrent workers, retries), so each refresh
+    re-reads the posts from the last 'reread_seconds' before the newest loaded one and
+    replaces them. Older rows changed afterwards (re-runs, backfilled old posts) are
+    picked up by a periodic full rebuild"""
+
+    def __init__(
+        self,
+        db: DBService,
+        full_refresh_seconds: float = 3600,
+        reread_seconds: float = 900,
+    ):
+        self.db = db
+        self.full_refresh_seconds = full_refresh_seconds
+        # Same window in snowflake units: the post time is in the bits above 22
+        self.reread_window = int(reread_seconds * 1000) << 22
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.ogmessage_ids = np.empty(0, dtype=np.int64)
+        self.author_ids = np.empty(0, dtype=np.int64)
+        # NaN when the post has no roundness
+        self.roundness = np.empty(0, dtype=np.float64)
+        # One column per label, 0 when the label wasn't detected
+        self.labels = np.empty((0, 0), dtype=np.float32)
+        self.label_names: list[str] = []
+        self.last_ogmessage_id = 0
+        self.last_full_refresh = time.monotonic()
+
+    def refresh(self) -> int:
+        """Loads the new rows, returns how many were added"""
+        with self._lock:
+            if time.monotonic() - self.last_full_refresh > self.full_refresh_seconds:
+                logger.info("Rebuilding messages snapshot")
+                self._reset()
+            since = max(self.last_ogmessage_id - self.reread_window, 0)
+            rows = self.db.select_message_columns_after(since)
+            # The arrays are sorted by id: drop the re-read tail before appending it
+            kept = int(np.searchsorted(self.ogmessage_ids, since, side="right"))
+            added = len(rows) - (len(self.ogmessage_ids) - kept)
+            if rows:
+                self._truncate(kept)
+                self._append(rows)
+            logger.debug(
+                f"Messages snapshot: {added} new rows, {len(self.ogmessage_ids)} total"
+            )
+            return added
+
+    def _truncate(self, count: int) -> None:
+        self.ogmessage_ids = self.ogmessage_ids[:count]
+        self.author_ids = self.author_ids[:count]
+        self.roundness = self.roundness[:count]
+        self.labels = self.labels[:count]
+
+    def _append(self, rows: list[tuple]) -> None:
+        count = len(rows)
+        ids, authors, roundness, labels_json = zip(*rows)
+        parsed_labels = [
+            json.loads(labels) if labels else None for labels in labels_json
+        ]
+        label_index = {name: i for i, name in enumerate(self.label_names)}
+        for labels in parsed_labels:
+            for name in labels or {}:
+                if name not in label_index:
+                    label_index[name] = len(self.label_names)
+                    self.label_names.append(name)
+        new_labels = np.zeros((count, len(self.label_names)), dtype=np.float32)
+        for row, labels in enumerate(parsed_labels):
+            for name, confidence in (labels or {}).items():
+                new_labels[row, label_index[name]] = confidence
+        # Older rows get zeros for labels seen for the first time
+        old_labels = np.zeros(
+            (len(self.ogmessage_ids), len(self.label_names)), np.float32
+        )
+        old_labels[:, : self.labels.shape[1]] = self.labels
+
+        self.ogmessage_ids = np.concatenate(
+            [self.ogmessage_ids, np.fromiter(ids, np.int64, count)]
+        )
+        self.author_ids = np.concatenate(
+            [
+                self.author_ids,
+                np.fromiter(
+                    (a if a is not None else -1 for a in authors), np.int64, count
+                ),
+            ]
+        )
+        self.roundness = np.concatenate(
+            [
+                self.roundness,
+                np.fromiter(
+                    (r if r is not None else np.nan for r in roundness),
+                    np.float64,
+                    count,
+                ),
+            ]
+        )
+        self.labels = np.concatenate([old_labels, new_labels])
+        self.last_ogmessage_id = int(self.ogmessage_ids[-1])
+
+    def compute_stats(
+        self, min_confidence: float, bins: int = 10, top: int = 5
+    ) -> ServerStats:
+        with self._lock:
+            return self._compute_stats(min_confidence, bins, top)
+
+    def _compute_stats(self, min_confidence: float, bins: int, top: int) -> ServerStats:
+        rated = ~np.isnan(self.roundness)
+        rated_roundness = self.roundness[rated]
+        histogram, edges = np.histogram(rated_roundness, bins=bins, range=(0.0, 1.0))
+        percentiles = (
+            dict(zip((10, 50, 90), np.percentile(rated_roundness, [10, 50, 90])))
+            if rated_roundness.size
+            else {}
+        )
+
+        # Labels: presence matrix (posts x labels)
+        present = (self.labels >= min_confidence).astype(np.int64)
+        label_counts = present.sum(axis=0)
+        cooccurrence = present.T @ present
+        pairs_i, pairs_j = np.triu_indices(len(self.label_names), k=1)
+        pair_counts = cooccurrence[pairs_i, pairs_j]
+        best_pairs = np.argsort(pair_counts)[::-1][:top]
+        label_pairs = [
+            (
+                self.label_names[pairs_i[p]],
+                self.label_names[pairs_j[p]],
+                int(pair_counts[p]),
+            )
+            for p in best_pairs
+            if pair_counts[p] > 0
+        ]
+        # Mean roundness of the rated posts having each label
+        rated_present = present[rated]
+        per_label_posts = rated_present.sum(axis=0)
+        per_label_total = rated_present.T @ rated_roundness
+        roundness_by_label = {
+            name: float(per_label_total[i] / per_label_posts[i])
+            for i, name in enumerate(self.label_names)
+            if per_label_posts[i] > 0
+        }
+
+        # Bakers: posts and mean roundness per author
+        known = self.author_ids >= 0
+        authors, inverse, posts = np.unique(
+            self.author_ids[known], return_inverse=True, return_counts=True
+        )
+        author_rated = rated[known]
+        # bincount gives int64 instead of float64 for empty inputs, hence the astype
+        rated_posts = np.bincount(
+            inverse, weights=author_rated, minlength=authors.size
+        ).astype(np.float64)
+        roundness_total = np.bincount(
+            inverse,
+            weights=np.where(author_rated, self.roundness[known], 0.0),
+            minlength=authors.size,
+        ).astype(np.float64)
+        mean_roundness = np.divide(
+            roundness_total,
+            rated_posts,
+            out=np.zeros(authors.size, dtype=np.float64),
+            where=rated_posts > 0,
+        )
+        most_active = np.argsort(posts, kind="stable")[::-1][:top]
+        top_bakers = [
+            (int(authors[a]), int(posts[a]), float(mean_roundness[a]))
+            for a in most_active
+        ]
+
+        return ServerStats(
+            posts=int(self.ogmessage_ids.size),
+            rated_posts=int(rated_roundness.size),
+            roundness_mean=float(rated_roundness.mean())
+            if rated_roundness.size
+            else 0.0,
+            roundness_percentiles={k: float(v) for k, v in percentiles.items()},
+            roundness_histogram=histogram.tolist(),
+            roundness_bin_edges=edges.tolist(),
+            label_counts={
+                name: int(label_counts[i]) for i, name in enumerate(self.label_names)
+            },
+            roundness_by_label=roundness_by_label,
+            label_pairs=label_pairs,
+            top_bakers=top_bakers,
+        )
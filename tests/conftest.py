@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+# The bot modules read the settings at import, the tests don't talk to Discord
+os.environ.setdefault("__DISCORD_TOKEN", "test")
+os.environ.setdefault("__DISCORD_BREAD_CHANNELS", "[1]")
+os.environ.setdefault("__DISCORD_BREAD_ROLE", "[1]")
+
+from db.service import DBService
+
+
+@pytest.fixture
+def db(tmp_path) -> DBService:
+    db = DBService(str(tmp_path / "messages.db"))
+    db.create_db()
+    return db
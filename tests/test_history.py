@@ -0,0 +1,97 @@
+from datetime import UTC, date, datetime, timedelta
+
+import pytest
+
+from db.models import Message, datetime_to_snowflake
+from db.service import HistoryGranularity
+from discordclient.service import HISTORY_MAX_PAGE, DiscordBot
+
+
+def post(posted_at: datetime, roundness: float, author_id: int = 7) -> Message:
+    ogmessage_id = datetime_to_snowflake(posted_at)
+    return Message(
+        ogmessage_id=ogmessage_id,
+        replymessage_jump_url="",
+        replymessage_id=ogmessage_id + 1,
+        author_id=author_id,
+        channel_id=1,
+        guild_id=1,
+        roundness=roundness,
+        labels_json={"bread": 0.9},
+    )
+
+
+def test_weeks_start_on_monday(db):
+    db.upsert_messages(
+        [
+            # Sunday, Monday and Saturday
+            post(datetime(2024, 1, 7, 12, tzinfo=UTC), 0.2),
+            post(datetime(2024, 1, 8, 12, tzinfo=UTC), 0.4),
+            post(datetime(2024, 1, 13, 12, tzinfo=UTC), 0.8),
+        ]
+    )
+    buckets = db.get_roundness_history_buckets(7, HistoryGranularity.WEEK)
+    assert [(b.bucket_start, b.count) for b in buckets] == [
+        (date(2024, 1, 8), 2),
+        (date(2024, 1, 1), 1),
+    ]
+    assert buckets[0].mean == pytest.approx(0.6)
+    assert (buckets[0].min, buckets[0].max) == (0.4, 0.8)
+
+
+def test_rolling_mean_spans_pages(db):
+    first_monday = datetime(2024, 1, 1, 12, tzinfo=UTC)
+    db.upsert_messages(
+        [post(first_monday + timedelta(weeks=i), (i + 1) / 10) for i in range(6)]
+        # Other authors don't count
+        + [post(first_monday + timedelta(days=1), 1.0, author_id=8)]
+    )
+    everything = db.get_roundness_history_buckets(
+        7, HistoryGranularity.WEEK, rolling_window=3
+    )
+    page = db.get_roundness_history_buckets(
+        7, HistoryGranularity.WEEK, rolling_window=3, limit=2, offset=2
+    )
+    assert page == everything[2:4]
+    # Weeks 2 to 4 and 1 to 3, newest first
+    assert [b.rolling_mean for b in page] == pytest.approx([0.3, 0.2])
+    # The oldest buckets average over what there is
+    assert everything[-1].rolling_mean == pytest.approx(0.1)
+
+
+def test_history_options_defaults():
+    assert DiscordBot.parse_history_options([]) == (None, HistoryGranularity.POST, 1)
+
+
+def test_history_options():
+    since, granularity, page = DiscordBot.parse_history_options(
+        ["--range", "2w", "--by", "month", "--page", "3"]
+    )
+    assert datetime.now(UTC) - since == pytest.approx(
+        timedelta(weeks=2), abs=timedelta(minutes=1)
+    )
+    assert granularity == HistoryGranularity.MONTH
+    assert page == 3
+
+
+def test_history_options_range_older_than_discord():
+    assert DiscordBot.parse_history_options(["--range", "99999999y"])[0] is None
+    assert DiscordBot.parse_history_options(["--range", "all"])[0] is None
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--range"],
+        ["--range", "2x"],
+        ["--by", "decade"],
+        ["--page", "0"],
+        ["--page", "two"],
+        ["--page", str(HISTORY_MAX_PAGE + 1)],
+        ["--page", "1" + "0" * 30],
+        ["--color", "red"],
+    ],
+)
+def test_invalid_history_options(args):
+    with pytest.raises(ValueError):
+        DiscordBot.parse_history_options(args)
@@ -0,0 +1,86 @@
+import time
+
+from db.queue import JobQueue, JobStatus
+from monitoring.tracing import TRACER
+
+
+def job_status(queue: JobQueue, job_id: int) -> str:
+    with queue.db.connect() as cursor:
+        cursor.execute("SELECT status FROM jobs WHERE id = ?", (job_id,))
+        (status,) = cursor.fetchone()
+    return status
+
+
+def test_claim_complete(db):
+    queue = JobQueue(db)
+    queue.create_table()
+    assert queue.enqueue(1, 10, 100, 0.5)
+    # One unfinished job per message
+    assert not queue.enqueue(1, 10, 100, 0.5)
+
+    job = queue.claim("w1")
+    assert job is not None
+    assert (job.ogmessage_id, job.worker, job.attempts) == (1, "w1", 1)
+    assert queue.claim("w2") is None
+    assert queue.complete(job)
+    assert job_status(queue, job.id) == JobStatus.DONE
+
+
+def test_expired_lease_is_claimed_again(db):
+    queue = JobQueue(db, lease_seconds=0.05)
+    queue.create_table()
+    queue.enqueue(1, 10, 100, 0.5)
+    stale = queue.claim("w1")
+    time.sleep(0.1)
+
+    job = queue.claim("w2")
+    assert job is not None
+    assert (job.id, job.worker, job.attempts) == (stale.id, "w2", 2)
+    # The first worker can't touch the job anymore
+    assert not queue.renew_lease(stale)
+    assert not queue.complete(stale)
+    assert not queue.fail(stale, "late")
+    assert job_status(queue, job.id) == JobStatus.RUNNING
+
+    assert queue.complete(job)
+    assert job_status(queue, job.id) == JobStatus.DONE
+
+
+def test_renewed_lease_is_not_claimed_again(db):
+    queue = JobQueue(db, lease_seconds=0.2)
+    queue.create_table()
+    queue.enqueue(1, 10, 100, 0.5)
+    job = queue.claim("w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.renew_lease(job)
+    assert queue.claim("w2") is None
+
+
+def test_fail_retries_then_gives_up(db):
+    queue = JobQueue(db, max_attempts=2, retry_delay_seconds=0)
+    queue.create_table()
+    queue.enqueue(1, 10, 100, 0.5)
+    assert queue.fail(queue.claim("w1"), "boom")
+    assert job_status(queue, 1) == JobStatus.PENDING
+    assert queue.fail(queue.claim("w1"), "boom")
+    assert job_status(queue, 1) == JobStatus.FAILED
+    assert queue.claim("w1") is None
+
+
+def test_job_continues_the_enqueue_trace(db):
+    queue = JobQueue(db)
+    queue.create_table()
+    with TRACER.trace("predict", message_id=1) as trace:
+        queue.enqueue(1, 10, 100, 0.5, trace_id=trace.trace_id)
+    job = queue.claim("w1")
+    assert job.trace_id == trace.trace_id
+
+    # Queue time counts toward the job trace
+    with TRACER.trace(
+        "job", trace_id=job.trace_id, started_at=job.created_at - 40
+    ) as job_trace:
+        pass
+    assert job_trace.trace_id == trace.trace_id
+    assert job_trace.spans[0].name == "queue_wait"
+    assert job_trace.duration >= 40
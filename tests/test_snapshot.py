@@ -0,0 +1,66 @@
+from db.models import Message
+from stats.snapshot import MessageSnapshot
+
+
+def message(ogmessage_id: int, author_id: int | None, roundness: float | None):
+    return Message(
+        ogmessage_id=ogmessage_id,
+        replymessage_jump_url="",
+        replymessage_id=ogmessage_id + 1,
+        author_id=author_id,
+        channel_id=1,
+        guild_id=1,
+        roundness=roundness,
+        labels_json={"bread": 0.9},
+    )
+
+
+def test_empty_snapshot(db):
+    snapshot = MessageSnapshot(db)
+    assert snapshot.refresh() == 0
+    stats = snapshot.compute_stats(min_confidence=0.5)
+    assert stats.posts == 0
+    assert stats.rated_posts == 0
+    assert stats.top_bakers == []
+
+
+def test_snapshot_without_authors(db):
+    # Rows written by upsert_message_stats only have no author
+    db.upsert_message_stats(ogmessage_id=10, roundness=0.8, labels_json={"bread": 0.9})
+    db.upsert_message_stats(ogmessage_id=20, roundness=0.4, labels_json={"bread": 0.9})
+    snapshot = MessageSnapshot(db)
+    assert snapshot.refresh() == 2
+    stats = snapshot.compute_stats(min_confidence=0.5)
+    assert stats.posts == 2
+    assert abs(stats.roundness_mean - 0.6) < 1e-9
+    assert stats.label_counts == {"bread": 2}
+    assert stats.top_bakers == []
+
+
+def test_snapshot_bakers_and_incremental_refresh(db):
+    db.upsert_messages([message(10, 42, 0.8), message(20, 7, None)])
+    snapshot = MessageSnapshot(db)
+    snapshot.refresh()
+    db.upsert_messages([message(30, 42, 0.6)])
+    assert snapshot.refresh() == 1
+    stats = snapshot.compute_stats(min_confidence=0.5)
+    assert stats.posts == 3
+    assert stats.rated_posts == 2
+    baker_id, posts, roundness = stats.top_bakers[0]
+    assert (baker_id, posts) == (42, 2)
+    assert abs(roundness - 0.7) < 1e-9
+
+
+def test_refresh_picks_up_rows_written_out_of_order(db):
+    # A worker stores a newer post before another worker stores an older one
+    db.upsert_messages([message(30 << 22, 42, 0.6)])
+    snapshot = MessageSnapshot(db)
+    assert snapshot.refresh() == 1
+    db.upsert_messages([message(20 << 22, 42, 0.8)])
+    assert snapshot.refresh() == 1
+    # Re-read rows replace the loaded ones instead of being counted twice
+    assert snapshot.refresh() == 0
+    stats = snapshot.compute_stats(min_confidence=0.5)
+    assert stats.posts == 2
+    assert snapshot.ogmessage_ids.tolist() == [20 << 22, 30 << 22]
+    assert stats.top_bakers[0][:2] == (42, 2)